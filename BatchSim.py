@@ -0,0 +1,73 @@
+"""
+This module simulates a circuit on a batch of statevectors at once. The batch is kept as one (batch, 2^n) array,
+so each gate of the circuit is applied to every statevector of the batch in one vectorised operation.
+The batch may also give different values to the Parameters of the circuit.
+"""
+import numpy as np
+import Sparse
+import Simulator
+from MatrixInterface import Vector
+from Operations import Parameter
+
+class BatchSimulator():
+    def __init__(self, operations, states, custom, values=None):
+        """
+        Initialiser for the batch simulator.
+
+        :param operations: (OperationList) The operations of the Quantum Circuit.
+        :param states: (numpy.ndarray) The (batch, 2^n) array of initial statevectors.
+        :param custom: (dict) Dictionary of user defined custom gates.
+        :param values: (dict) The values of Parameters for each statevector of the batch, as arrays by name.
+            Parameters which are not given keep the value bound in the circuit.
+        """
+        self.operations = operations
+        self.states = Vector(states)
+        self.customgates = custom
+        self.values = {} if values is None else values
+        self.size = 2**operations.size
+
+    def __value(self, param):
+        """
+        Finds the value of a gate parameter
+
+        :param param: (float or Parameter) The parameter as stored in the circuit
+        :return: (float or numpy.ndarray) The value, or the values for each statevector of the batch
+        """
+        if not isinstance(param, Parameter): return param
+        if param.name in self.values: return self.values[param.name]
+        if param.name in self.operations.values: return self.operations.values[param.name]
+        return float(param)
+
+    def __lazyGate(self, gate_info, qbit):
+        """
+        Creates the lazy gate for a gate of the circuit. A gate whose parameter has a value for each
+        statevector of the batch is a DiagonalGate with a phase for each of them.
+
+        :param gate_info: (str or tuple) The gate as stored in the circuit, possibly holding Parameters
+        :param qbit: (int) The lowest qubit the gate acts on
+        :return: (Gate, DiagonalGate or PermutationGate) The gate, or None for the identity
+        """
+        if type(gate_info) == tuple and isinstance(gate_info[-1], Parameter):
+            value = self.__value(gate_info[-1])
+            if np.ndim(value) == 1:
+                phases = np.exp(1j*np.asarray(value, dtype=float))
+                if gate_info[0] == 'r': return Sparse.DiagonalGate(self.size, [qbit], [1], [phases])
+                return Sparse.DiagonalGate.controlled(self.size, list(gate_info[1:-1]), phases)
+            gate_info = gate_info[:-1] + (value,)
+        return Simulator.lazyGate(gate_info, qbit, self.size, self.customgates)
+
+    def simulate(self):
+        """
+        Applies the circuit to every statevector of the batch
+
+        :return: (numpy.ndarray) The (batch, 2^n) array of final statevectors
+        :return: (list) The (batch, 2^n) arrays of statevectors at each measurement
+        """
+        snapshots = []
+        for gate_info, qbit in self.operations.entries(symbolic=True):
+            if gate_info == 'measure':
+                snapshots.append(self.states.Elements.copy())
+                continue
+            gate = self.__lazyGate(gate_info, qbit)
+            if gate is not None: gate.apply(self.states, out=self.states)
+        return self.states.Elements, snapshots
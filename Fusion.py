@@ -0,0 +1,253 @@
+"""
+This module includes the optimisation passes which fuse neighbouring gates of a QuantumCircuit together,
+so that the statevector is swept through fewer times when the circuit is simulated.
+"""
+import itertools
+import numpy as np
+import Sparse
+import Simulator
+import Operations
+from GateCache import compiled
+
+# numbers the custom gates made by fuseSingleGates, so names stay unique when unused ones are removed
+fusedNames = itertools.count()
+# the names of the custom gates made by fuseSingleGates, the only ones it removes
+fusedGates = set()
+
+
+def singleMatrix(gate, customgates):
+    """
+    Finds the 2x2 matrix of a gate acting on a single qubit
+
+    :param gate: (str or tuple) The gate as stored in the circuit
+    :param customgates: (dict) The custom gates of the circuit
+    :return: (numpy.ndarray) The matrix of the gate, or None if the gate acts on more than one qubit
+        or has a Parameter
+    """
+    if type(gate) != tuple:
+        return compiled(gate).dense()
+    if gate[0] == 'r':
+        if isinstance(gate[1], Operations.Parameter): return None
+        return compiled('r', gate[1:]).dense()
+    if gate[0] == 'custom' and gate[1] == gate[2]:
+        return Sparse.toDense(customgates[gate[-1]])
+    return None
+
+def fuseSingleGates(circuit):
+    """
+    Multiplies together each run of single qubit gates acting one after another on the same qubit, 
+    and replaces the run with one custom gate holding the product. Runs whose product is the identity
+    are removed. A run ends at any gate acting on more than one qubit, at gates with a Parameter,
+    which stays in the circuit so that it can be bound again, and at every measurement.
+    Custom gates made by earlier fusions which are no longer used by any operation are removed,
+    while the custom gates of the user are always kept.
+
+    :param circuit: (QuantumCircuit) The circuit to optimise, its operations are replaced
+    :return: (int) The number of gate applications saved
+    """
+    entries = list(circuit.operations.entries(symbolic=True))
+    runs, saved = {}, 0
+    for index, (gate_info, qbit) in enumerate(entries):
+        if gate_info == 'i': continue
+        if gate_info == 'measure': ending = list(runs)
+        else:
+            matrix = singleMatrix(gate_info, circuit.customgates)
+            if matrix is not None:
+                run, product = runs.get(qbit, ([], np.eye(2, dtype=complex)))
+                runs[qbit] = (run + [index], matrix.dot(product))
+                continue
+            if gate_info[0] in Operations.SINGLE: ending = [qbit] if qbit in runs else []
+            else: ending = [q for q in Operations.qubitsOf(gate_info) if q in runs]
+        for q in ending:
+            saved += _replaceRun(circuit, entries, q, *runs.pop(q))
+    for q in list(runs):
+        saved += _replaceRun(circuit, entries, q, *runs.pop(q))
+    operations = circuit.operations.emptyCopy()
+    for entry in entries:
+        if entry is not None: operations.addEntry(*entry)
+    circuit.operations = operations
+    used = {gate_info[-1] for gate_info, qbit in operations.entries(symbolic=True) if type(gate_info) == tuple and gate_info[0] == 'custom'}
+    for name in [name for name in circuit.customgates if name in fusedGates and name not in used]:
+        del circuit.customgates[name]
+        fusedGates.discard(name)
+    return saved
+
+def _replaceRun(circuit, entries, qbit, run, product):
+    """
+    Replaces a run of single qubit gates by their product
+
+    :param circuit: (QuantumCircuit) The circuit being optimised
+    :param entries: (list) The (gate_info, qubit) pairs of the circuit, changed in place
+    :param qbit: (int) The qubit the run acts on
+    :param run: (list) The positions of the gates of the run in entries
+    :param product: (numpy.ndarray) The product of the gates in the run
+    :return: (int) The number of gates removed
+    """
+    identity = np.allclose(product, np.eye(2))
+    if len(run) < 2 and not (identity and len(run) == 1): return 0
+    for index in run:
+        entries[index] = None
+    if identity: return len(run)
+    name = f'fused_{qbit}_{next(fusedNames)}'
+    circuit.customgates[name] = Sparse.toColMat(product)
+    fusedGates.add(name)
+    entries[run[-1]] = (('custom', qbit, qbit, name), qbit)
+    return len(run) - 1
+
+
+class CostModel():
+    """
+    Estimates the cost of applying a lazy gate to the statevector, in units of one sweep through the statevector.
+    A dense gate on k qubits costs dense + flop*2**k, plus reorder when its qubits are not a sorted 
+    unbroken range. Diagonal and permutation gates only touch part of the statevector and have a fixed cost.
+    """
+    def __init__(self, dense=3.0, flop=0.1, reorder=8.0, diagonal=1.0, permutation=3.0):
+        self.dense = dense
+        self.flop = flop
+        self.reorder = reorder
+        self.diagonal = diagonal
+        self.permutation = permutation
+    
+    def cost(self, gate):
+        """
+        :param gate: (Gate, DiagonalGate or PermutationGate) The lazy gate
+        :return: (float) The estimated cost of applying the gate
+        """
+        if type(gate) == Sparse.DiagonalGate: return self.diagonal
+        if type(gate) == Sparse.PermutationGate: return self.permutation
+        cost = self.dense + self.flop * 2**gate.qbpos.size
+        if (gate.qbpos != np.arange(gate.qbpos.min(), gate.qbpos.min() + gate.qbpos.size)).any():
+            cost += self.reorder
+        return cost
+
+
+class Block():
+    """
+    A group of gates acting on a few qubits, which is applied to the statevector as one gate
+    
+    :param size: (int) The dimension of the statevector
+    :param gates: (list) The lazy gates of the block, in the order they are applied
+    :param qubits: (list) The sorted qubits the gates act on
+    :param matrix: (numpy.ndarray) The product of the gates acting on the qubits
+    """
+    def __init__(self, size, gates, qubits, matrix):
+        self.size = size
+        self.gates = gates
+        self.qubits = qubits
+        self.matrix = matrix
+        if len(gates) == 1: self.gate = gates[0]
+        else: self.gate = Sparse.makeGate(size, Sparse.toColMat(matrix), qubits)
+    
+    @classmethod
+    def merge(cls, blocks, gate):
+        """
+        Creates the block applying a number of blocks on different qubits followed by a gate
+
+        :param blocks: (list) The blocks, each acting on different qubits, may be empty
+        :param gate: (Gate, DiagonalGate or PermutationGate) The gate applied after the blocks
+        :return: (Block) The merged block
+        """
+        qubits = sorted(set(gate.qbpos.tolist()).union(*[block.qubits for block in blocks]))
+        matrix = expand(gate.smallMatrix(), gate.qbpos, qubits)
+        gates = []
+        for block in blocks:
+            matrix = matrix.dot(expand(block.matrix, block.qubits, qubits))
+            gates += block.gates
+        return cls(gate.Dimension, gates + [gate], qubits, matrix)
+
+
+def expand(matrix, qbpos, qubits):
+    """
+    Expands a matrix acting on some qubits to a matrix acting on a larger set of qubits
+
+    :param matrix: (numpy.ndarray) The matrix, bit k of its index gives the value of qbpos[k]
+    :param qbpos: (list) The qubits the matrix acts on
+    :param qubits: (list) The qubits of the expanded matrix, containing all of qbpos
+    :return: (numpy.ndarray) The expanded matrix
+    """
+    qbpos = list(qbpos)
+    n = len(qubits)
+    # in the kronecker product the low bits belong to qbpos and the high bits to the other qubits
+    order = qbpos + [q for q in qubits if q not in qbpos]
+    full = np.kron(np.eye(2**(n - len(qbpos))), matrix).reshape((2,)*(2*n))
+    # axis a of each half holds bit n-1-a, move it to the axis of its position in qubits
+    axes = [n - 1 - order.index(qubits[n - 1 - a]) for a in range(n)]
+    return full.transpose(axes + [n + a for a in axes]).reshape(2**n, 2**n)
+
+
+class FusedCircuit():
+    """
+    A circuit compiled into a list of lazy gates, each one applied in a single pass over the statevector
+
+    :param program: (list) The lazy gates in the order they are applied, with None where a measurement is taken
+    :param gatecount: (int) The number of gates of the circuit before fusion
+    """
+    def __init__(self, program, gatecount):
+        self.program = program
+        self.gatecount = gatecount
+        self.passes = len([gate for gate in program if gate is not None])
+        self.saved = gatecount - self.passes
+    
+    def simulate(self, register, measurements):
+        """
+        Applies the compiled circuit to the statevector of a register
+
+        :param register: (QuantumRegister) The register to apply the circuit to
+        :param measurements: (list) The slots of the circuit where measurements are taken
+        :return: The register and the measurements, in the same form as the other simulators
+        """
+        snapshots = []
+        for gate in self.program:
+            if gate is None: snapshots.append(register.Statevec.Elements.copy())
+            else: gate.apply(register.Statevec, out=register.Statevec)
+        return register, [measurements, snapshots]
+
+
+def fuseBlocks(circuit, k=4, costmodel=None):
+    """
+    Greedily groups neighbouring gates of a circuit into blocks acting on at most k qubits. A gate joins
+    the open blocks on its qubits when the union has at most k qubits and the cost model estimates
+    that applying the merged block is cheaper than applying the blocks and the gate separately.
+    Otherwise those blocks are closed and the gate starts a new block. Gates on more than k qubits are
+    applied on their own, and all blocks are closed at measurements.
+
+    :param circuit: (QuantumCircuit) The circuit to compile
+    :param k: (int) The largest number of qubits of a block
+    :param costmodel: (CostModel) The cost model, defaults to CostModel()
+    :return: (FusedCircuit) The compiled circuit
+    """
+    if costmodel is None: costmodel = CostModel()
+    size = 2**circuit.size
+    program, blocks, gatecount = [], [], 0
+    
+    def close(closing):
+        for block in closing:
+            blocks.remove(block)
+            program.append(block.gate)
+    
+    for gate_info, qbit in circuit.operations:
+        if gate_info == 'measure':
+            close(list(blocks))
+            program.append(None)
+            continue
+        gate = Simulator.lazyGate(gate_info, qbit, size, circuit.customgates)
+        if gate is None: continue
+        gatecount += 1
+        touching = [block for block in blocks if set(block.qubits).intersection(gate.qbpos.tolist())]
+        if gate.qbpos.size > k:
+            # too large to be part of a block, so it is applied on its own
+            close(touching)
+            program.append(gate)
+            continue
+        qubits = set(gate.qbpos.tolist()).union(*[block.qubits for block in touching])
+        if len(touching) > 0 and len(qubits) <= k:
+            merged = Block.merge(touching, gate)
+            separate = sum(costmodel.cost(block.gate) for block in touching) + costmodel.cost(gate)
+            if costmodel.cost(merged.gate) <= separate:
+                for block in touching: blocks.remove(block)
+                blocks.append(merged)
+                continue
+        close(touching)
+        blocks.append(Block.merge([], gate))
+    close(list(blocks))
+    return FusedCircuit(program, gatecount)
@@ -0,0 +1,199 @@
+"""
+This module keeps a process wide cache of the compiled matrices of the gates, so that the small matrix of a gate
+is built once and shared by every simulator, slot and circuit using the same gate. The cache is keyed by the
+kind of gate, its parameters and the number of qubits it acts on, and evicts the least recently used entry when full.
+"""
+from collections import OrderedDict
+import numpy as np
+import Sparse
+
+# matrices of the single qubit gates, by the names used in the circuit
+singlegates = {'x' : np.array([[0,1], [1,0]]),
+               'y' : np.array([[0,-1j], [1j,0]]),
+               'z' : np.array([[1,0], [0,-1]]),
+               'h' : np.array([[1,1],[1,-1]])/np.sqrt(2),
+               'p' : np.array([[1,0],[0,1j]]),
+               't' : np.array([[1,0],[0,np.exp(1j*np.pi/4)]]),
+               'i' : np.eye(2)
+               }
+
+
+class GateCache():
+    """
+    A least recently used cache which counts its hits and misses
+
+    :param maxsize: (int) The largest number of entries kept
+    """
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """
+        Finds an entry of the cache, building and storing it if it is missing
+
+        :param key: (tuple) The key of the entry
+        :param build: (function) Creates the entry when called with no arguments
+        :return: The entry
+        """
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        entry = build()
+        self.entries[key] = entry
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return entry
+
+    def peek(self, key, build):
+        """
+        Finds an entry of the cache without counting it or changing the order of the entries. A missing 
+        entry is built but not stored, so that checking gates leaves the cache as it was.
+
+        :param key: (tuple) The key of the entry
+        :param build: (function) Creates the entry when called with no arguments
+        :return: The entry
+        """
+        if key in self.entries: return self.entries[key]
+        return build()
+
+    def resize(self, maxsize):
+        """
+        Changes the largest number of entries kept, evicting the least recently used ones if needed
+
+        :param maxsize: (int) The new largest number of entries
+        """
+        self.maxsize = maxsize
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes every entry and resets the counters
+        """
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        """
+        :return: (dict) The hits, misses, number of entries and largest number of entries of the cache
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'maxsize': self.maxsize}
+
+
+class CompiledGate():
+    """
+    The compiled matrices of a gate acting on its own qubits. Bit k of the index of the matrices gives
+    the value of the k-th qubit of the gate, and for controlled not gates the target is qubit 0.
+    A diagonal gate keeps the entries of its diagonal which are not 1 and a permutation gate its permutation,
+    so that large controlled gates never need their full matrix. The other forms are made when first asked for.
+
+    :param kind: (str) The kind of gate, as used in the circuit
+    :param params: (tuple) The parameters of the gate
+    :param arity: (int) The number of qubits the gate acts on
+    """
+    def __init__(self, kind, params, arity):
+        self.Kind = kind
+        self.Params = params
+        self.Arity = arity
+        self.Diagonal = None
+        self.Perm = None
+        self.Matrix = None
+        self.Sparse = None
+        self.Col = None
+        last = 2**arity - 1
+        if kind in singlegates:
+            self.Matrix = np.array(singlegates[kind], dtype=complex)
+            diagonal = Sparse.diagonalOf(self.Matrix)
+            if diagonal is not None:
+                indices = np.flatnonzero(diagonal != 1)
+                self.Diagonal = (indices, diagonal[indices])
+            else: self.Perm = Sparse.permutationOf(self.Matrix)
+        elif kind == 'r':
+            self.Diagonal = (np.array([1]), np.array([np.exp(1j*complex(params[0]))]))
+        elif kind in ('cz', 'ncz'):
+            self.Diagonal = (np.array([last]), np.array([-1], dtype=complex))
+        elif kind in ('cp', 'ncp'):
+            self.Diagonal = (np.array([last]), np.array([np.exp(1j*complex(params[0]))]))
+        elif kind in ('cn', 'ccn'):
+            self.Perm = np.arange(last + 1)
+            self.Perm[-2:] = self.Perm[-2:][::-1]
+        elif kind == 'swap':
+            self.Perm = np.array([0, 2, 1, 3])
+        else: raise ValueError(f'No compiled matrix for gate {kind}')
+        if self.Matrix is not None: self.Matrix.setflags(write=False)
+
+    def dense(self):
+        """
+        :return: (numpy.ndarray) The dense matrix of the gate, which must not be changed
+        """
+        if self.Matrix is None:
+            if self.Diagonal is not None:
+                diagonal = np.ones(2**self.Arity, dtype=complex)
+                diagonal[self.Diagonal[0]] = self.Diagonal[1]
+                self.Matrix = np.diag(diagonal)
+            else:
+                self.Matrix = np.zeros((self.Perm.size, self.Perm.size), dtype=complex)
+                self.Matrix[self.Perm, np.arange(self.Perm.size)] = 1
+            self.Matrix.setflags(write=False)
+        return self.Matrix
+
+    def sparse(self):
+        """
+        :return: (SparseMatrix) The matrix of the gate as a SparseMatrix
+        """
+        if self.Sparse is None: self.Sparse = Sparse.SparseMatrix.from_dense(self.dense())
+        return self.Sparse
+
+    def col(self):
+        """
+        :return: (ColMatrix) The matrix of the gate as a ColMatrix
+        """
+        if self.Col is None: self.Col = Sparse.ColMatrix.from_dense(self.dense())
+        return self.Col
+
+    def lazyGate(self, dims, qbpos):
+        """
+        Creates the lazy gate applying the compiled gate to some qubits of the statevector
+
+        :param dims: (int) The dimension of the statevector
+        :param qbpos: (list) The qubits of the gate, in the order of the bits of the matrix index
+        :return: (DiagonalGate, PermutationGate or Gate) The gate
+        """
+        if self.Diagonal is not None: return Sparse.DiagonalGate(dims, qbpos, *self.Diagonal)
+        if self.Perm is not None: return Sparse.PermutationGate(dims, qbpos, self.Perm)
+        gate = Sparse.Gate(dims, self.col(), qbpos)
+        gate.Matrix = self.dense()
+        return gate
+
+
+cache = GateCache()
+
+def compiled(kind, params=(), arity=1):
+    """
+    Finds the compiled matrices of a gate in the process wide cache, compiling them if they are missing
+
+    :param kind: (str) The kind of gate, as used in the circuit
+    :param params: (tuple) The parameters of the gate
+    :param arity: (int) The number of qubits the gate acts on
+    :return: (CompiledGate) The compiled gate
+    """
+    params = tuple(params)
+    return cache.get((kind, params, arity), lambda: CompiledGate(kind, params, arity))
+
+def peeked(kind, params=(), arity=1):
+    """
+    Finds the compiled matrices of a gate like compiled, without changing the cache or its counters
+
+    :param kind: (str) The kind of gate, as used in the circuit
+    :param params: (tuple) The parameters of the gate
+    :param arity: (int) The number of qubits the gate acts on
+    :return: (CompiledGate) The compiled gate
+    """
+    params = tuple(params)
+    return cache.peek((kind, params, arity), lambda: CompiledGate(kind, params, arity))
@@ -64,6 +64,9 @@ class SquareMatrix(ABC):
     @abstractmethod
     def multiply():
         pass
+
+    def __mul__(self, a):
+        return self.multiply(a)
     
     def apply(self, v):
         assert self.Dimension == v.Dimension, f'Incompatible dimensions: {self.Dimension}, {v.Dimension}'
@@ -73,9 +76,71 @@ class SquareMatrix(ABC):
         return Vector(u)
 
 class Vector(): 
-    def __init__(self, elements):
-        self.Dimension = np.array(elements).size
-        self.Elements = np.array(elements, dtype=complex)
+    # number of arrays of elements allocated by vectors, for copies of their elements and spare buffers
+    Allocations = 0
+
+    def __init__(self, elements, dtype=None):
+        """
+        :param elements: (array) The elements of the vector, which are copied
+        :param dtype: (numpy.dtype) complex or numpy.complex64, defaults to complex64 for complex64 
+            elements and to complex otherwise. A real statevector may also be kept as floats.
+        """
+        elements = np.asarray(elements)
+        if dtype is None: dtype = np.complex64 if elements.dtype == np.complex64 else complex
+        self.Dimension = elements.size
+        self.Elements = np.array(elements, dtype=dtype)
+        self.Spare = None
+        self.Shared = False
+        Vector.Allocations += 1
+
+    @classmethod
+    def wrap(cls, elements, shared=True):
+        """
+        Creates a Vector using an existing array as its elements, without copying it
+
+        :param elements: (numpy.ndarray) The elements
+        :param shared: (bool) Whether the array belongs to something else, like a memmap file, shared memory 
+            or a larger statevector, so that new elements must always be written into it
+        :return: (Vector) The vector
+        """
+        vector = cls.__new__(cls)
+        vector.Dimension = elements.size
+        vector.Elements = elements
+        vector.Spare = None
+        vector.Shared = shared
+        return vector
+
+    @classmethod
+    def empty(cls, size, dtype=complex):
+        """
+        Creates a Vector whose elements are allocated but not set, for callers which fill all of them
+
+        :param size: (int) The number of elements
+        :param dtype: (numpy.dtype) The dtype of the elements
+        :return: (Vector) The vector
+        """
+        Vector.Allocations += 1
+        return cls.wrap(np.empty(size, dtype=dtype), shared=False)
+
+    def spare(self):
+        """
+        Finds the second buffer of the vector, which gate kernels write the new elements into before
+        calling commit. It is made when first needed and reused while the elements keep their shape and dtype.
+
+        :return: (numpy.ndarray) An array with the shape and dtype of the elements
+        """
+        if self.Spare is None or self.Spare.shape != self.Elements.shape or self.Spare.dtype != self.Elements.dtype:
+            self.Spare = np.empty(self.Elements.shape, dtype=self.Elements.dtype)
+            Vector.Allocations += 1
+        return self.Spare
+
+    def commit(self):
+        """
+        Makes the new elements written into the spare buffer the elements of the vector, by swapping the 
+        two buffers. A shared vector copies them into its elements instead.
+        """
+        if self.Shared: self.Elements[...] = self.Spare
+        else: self.Elements, self.Spare = self.Spare, self.Elements
         
     def __getitem__(self, pos):
         return self.Elements[pos]
@@ -92,7 +157,7 @@ class Vector():
         """
         assert type(other_vec) == Vector, 'Incompatible vector'
         dimension = self.Dimension * other_vec.Dimension
-        elements = np.zeros(dimension, dtype=complex)
+        elements = np.zeros(dimension, dtype=np.result_type(self.Elements, other_vec.Elements))
         for i, element in enumerate(self.Elements):
             for j, other_element in enumerate(other_vec.Elements):
                 elements[i*other_vec.Dimension+j] = element * other_element
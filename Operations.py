@@ -0,0 +1,320 @@
+"""
+This module stores the gates of a QuantumCircuit as a compact list of operations. Each operation is an opcode,
+the qubits it acts on and its parameters, all kept in flat typed arrays, so adding a gate takes constant time.
+The slots of the circuit are only worked out when a simulator asks for them.
+"""
+from array import array
+import math
+
+SINGLE = ('i', 'x', 'y', 'z', 'h', 'p', 't', 'r')
+BIG = ('cn', 'ccn', 'swap', 'cz', 'cp', 'ncp', 'ncz', 'custom')
+KINDS = SINGLE + BIG + ('measure',)
+OPCODES = {kind: code for code, kind in enumerate(KINDS)}
+
+
+class Parameter():
+    """
+    A named angle of an r, cp or ncp gate, whose value is given later with QuantumCircuit.bind.
+    The same parameter may be used by many gates.
+
+    :param name: (str) The name of the parameter
+    """
+    def __init__(self, name):
+        self.name = str(name)
+
+    def __repr__(self):
+        return self.name
+
+    def __float__(self):
+        raise ValueError(f'Parameter {self.name} has not been bound')
+
+    def __complex__(self):
+        raise ValueError(f'Parameter {self.name} has not been bound')
+
+
+def qubitsOf(gate_info):
+    """
+    Finds the qubits a gate acts on
+
+    :param gate_info: (tuple) The gate info of a gate acting on more than one qubit, as stored in the circuit
+    :return: (list) The qubits of the gate. A custom gate acts on every qubit between its two end qubits.
+    """
+    if gate_info[0] == 'custom':
+        return list(range(min(gate_info[1:3]), max(gate_info[1:3]) + 1))
+    if gate_info[0] == 'cp' or gate_info[0] == 'ncp':
+        return list(gate_info[1:-1])
+    return list(gate_info[1:])
+
+
+class OperationList():
+    """
+    The operations of a circuit in the order they were added. Operation i has the opcode opcodes[i],
+    acts on the qubits qubits[qubitStarts[i]:qubitStarts[i+1]] and has the parameters
+    params[paramStarts[i]:paramStarts[i+1]]. A single qubit gate added to several qubits at once is one operation.
+    The names of custom gates are kept in names, and their parameter is the position of the name.
+    A parameter given as a Parameter is stored as nan until it is bound, and symbols holds the Parameter
+    and operation of each such position, so that binding only writes the new values.
+
+    :param size: (int) The number of qubits of the circuit
+    """
+    def __init__(self, size):
+        self.size = size
+        self.opcodes = array('b')
+        self.qubits = array('q')
+        self.qubitStarts = array('q', [0])
+        self.params = array('d')
+        self.paramStarts = array('q', [0])
+        self.names = []
+        self.symbols = {}
+        self.values = {}
+        self.asap = False
+        self.layout = None
+        self.cells = {}
+
+    def emptyCopy(self):
+        """
+        :return: (OperationList) An operation list with no operations, but the same layout and parameter values
+        """
+        operations = OperationList(self.size)
+        operations.asap = self.asap
+        operations.values = dict(self.values)
+        return operations
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def append(self, kind, qubits=(), params=()):
+        """
+        Adds an operation to the end of the list
+
+        :param kind: (str) The kind of operation, one of KINDS
+        :param qubits: (list) The qubits the operation acts on
+        :param params: (list) The parameters of the operation
+        """
+        self.opcodes.append(OPCODES[kind])
+        self.qubits.extend(int(q) for q in qubits)
+        self.qubitStarts.append(len(self.qubits))
+        for param in params:
+            if isinstance(param, Parameter):
+                self.symbols[len(self.params)] = (param, len(self.opcodes) - 1)
+                param = self.values.get(param.name, math.nan)
+            self.params.append(param)
+        self.paramStarts.append(len(self.params))
+        self.layout = None
+
+    def parameters(self):
+        """
+        :return: (dict) The parameters of the operations by name
+        """
+        return {param.name: param for param, index in self.symbols.values()}
+
+    def bind(self, values):
+        """
+        Gives values to parameters by writing them over the stored parameters. The layout is kept,
+        and only the gates using the parameters are changed in its grid.
+
+        :param values: (dict) The new values, keyed by Parameter or by name
+        """
+        values = {(key.name if isinstance(key, Parameter) else key): float(value) for key, value in values.items()}
+        names = self.parameters()
+        for name in values:
+            assert name in names, f'No parameter named {name} in the circuit'
+        self.values.update(values)
+        changed = set()
+        for position, (param, index) in self.symbols.items():
+            if param.name in values:
+                self.params[position] = values[param.name]
+                changed.add(index)
+        if self.layout is None: return
+        grid = self.layout[0]
+        for index in changed:
+            gate_info = self.gateInfo(index)
+            for qbit, slot in self.cells[index]:
+                grid[qbit][slot] = gate_info
+
+    def addGate(self, gate, bits):
+        """
+        Adds a single qubit gate acting on each of the given qubits
+
+        :param gate: (str or tuple) The gate, one of 'x', 'y', 'z', 'h', 'p', 't', 'i' or ('r', theta)
+        :param bits: (list) The qubits the gate acts on
+        """
+        if type(gate) == tuple: self.append(gate[0], bits, gate[1:])
+        else: self.append(gate, bits)
+
+    def addBigGate(self, gate_info):
+        """
+        Adds a gate acting on more than one qubit
+
+        :param gate_info: (tuple) The gate info in the same form as QuantumCircuit.addBigGate
+        """
+        kind = gate_info[0]
+        if kind == 'custom':
+            if gate_info[3] not in self.names: self.names.append(gate_info[3])
+            self.append(kind, gate_info[1:3], [self.names.index(gate_info[3])])
+        elif kind == 'cp' or kind == 'ncp':
+            self.append(kind, gate_info[1:-1], gate_info[-1:])
+        else: self.append(kind, gate_info[1:])
+
+    def addMeasure(self):
+        """
+        Adds a measurement of the statevector after all of the operations added so far
+        """
+        self.append('measure')
+
+    def addEntry(self, gate_info, qbit):
+        """
+        Adds an operation given in the form it is iterated over
+
+        :param gate_info: (str or tuple) The gate info, or 'measure'
+        :param qbit: (int) The qubit of a single qubit gate
+        """
+        if gate_info == 'measure': self.addMeasure()
+        elif type(gate_info) == tuple and gate_info[0] in BIG: self.addBigGate(gate_info)
+        else: self.addGate(gate_info, [qbit])
+
+    def kind(self, index):
+        """
+        :param index: (int) The position of the operation
+        :return: (str) The kind of the operation
+        """
+        return KINDS[self.opcodes[index]]
+
+    def operation(self, index, symbolic=False):
+        """
+        :param index: (int) The position of the operation
+        :param symbolic: (bool) Whether to give the Parameter rather than its value for parameters
+        :return: (str, list, list) The kind, qubits and parameters of the operation. An unbound parameter
+            is given as its Parameter.
+        """
+        params = []
+        for position in range(self.paramStarts[index], self.paramStarts[index+1]):
+            value = self.params[position]
+            if position in self.symbols and (symbolic or math.isnan(value)): value = self.symbols[position][0]
+            params.append(value)
+        return (KINDS[self.opcodes[index]],
+                self.qubits[self.qubitStarts[index]:self.qubitStarts[index+1]].tolist(), params)
+
+    def gateInfo(self, index, symbolic=False):
+        """
+        Gives the gate of an operation in the form it is stored in the grid of the circuit
+
+        :param index: (int) The position of the operation
+        :param symbolic: (bool) Whether to give the Parameter rather than its value for parameters
+        :return: (str or tuple) The gate info, or 'measure' for a measurement
+        """
+        kind, qubits, params = self.operation(index, symbolic)
+        if kind == 'custom': return (kind, *qubits, self.names[int(params[0])])
+        if kind in SINGLE and len(params) == 0: return kind
+        if kind == 'measure': return kind
+        if kind == 'r': return (kind, *params)
+        return (kind, *qubits, *params)
+
+    def __iter__(self):
+        """
+        Goes through the operations in order. A single qubit gate gives one (gate_info, qubit) pair for each
+        of its qubits, a larger gate gives its gate info and its lowest qubit, and a measurement gives ('measure', None).
+        """
+        return self.entries()
+
+    def entries(self, symbolic=False):
+        """
+        Goes through the operations in the same way as iterating over the list
+
+        :param symbolic: (bool) Whether to give the Parameter rather than its value for parameters
+        """
+        for index in range(len(self)):
+            gate_info = self.gateInfo(index, symbolic)
+            kind = KINDS[self.opcodes[index]]
+            if kind == 'measure':
+                yield gate_info, None
+            elif kind in SINGLE:
+                for qbit in self.qubits[self.qubitStarts[index]:self.qubitStarts[index+1]]:
+                    yield gate_info, qbit
+            else: yield gate_info, min(qubitsOf(gate_info))
+
+    def __cells(self, index, gate_info, kind):
+        """
+        Finds the cells of the grid taken up by an operation
+
+        :param index: (int) The position of the operation
+        :param gate_info: (str or tuple) The gate info of the operation
+        :param kind: (str) The kind of the operation
+        :return: (list) Dictionaries from qubit to the entry of the grid, one for each group of cells 
+            which have to be in the same slot
+        """
+        if kind in SINGLE:
+            return [{qbit: gate_info} for qbit in self.qubits[self.qubitStarts[index]:self.qubitStarts[index+1]]]
+        qubits = qubitsOf(gate_info)
+        low, high = min(qubits), max(qubits)
+        if not self.asap or kind == 'custom': qubits = range(low, high+1)
+        cells = {qbit: 's' for qbit in qubits}
+        cells[low] = gate_info
+        return [cells]
+
+    def getLayout(self):
+        """
+        Arranges the operations into the slots of the circuit. A measurement is taken after the operations 
+        added before it and ends its slot. The layout is kept until another operation is added.
+
+        By default an operation goes into the last slot when all of its qubits are free there, otherwise it 
+        starts a new slot, and a larger gate takes up every qubit from its lowest to its highest one.
+        With asap set, each operation goes into the earliest slot after the last operation on any of its 
+        qubits and the last measurement. Only custom gates then take up the qubits in between their end qubits,
+        as the other larger gates are applied on their own qubits.
+
+        :return: (list, list) The grid of gates with one row per qubit, as used by the simulators,
+            and the slots after which measurements are taken
+        """
+        if self.layout is not None: return self.layout
+        slots, measurements = [{}], []
+        symbolic = set(index for param, index in self.symbols.values())
+        self.cells = {index: [] for index in symbolic} # where the gates using parameters are in the grid
+        free = [0]*self.size # the first slot in which each qubit is free
+        barrier = 0 # the first slot after the last measurement
+        if self.asap: slots = []
+        for index in range(len(self)):
+            gate_info = self.gateInfo(index)
+            kind = KINDS[self.opcodes[index]]
+            if kind == 'measure':
+                if self.asap and len(slots) == barrier: slots.append({})
+                measurements.append(len(slots) - 1)
+                if not self.asap: slots.append({})
+                barrier = len(slots)
+                continue
+            groups = self.__cells(index, gate_info, kind)
+            if not self.asap:
+                cells = {qbit: gate for group in groups for qbit, gate in group.items()}
+                if any(slots[-1].get(qbit, 'i') != 'i' for qbit in cells): slots.append({})
+                slots[-1].update(cells)
+                if index in symbolic:
+                    self.cells[index] += [(qbit, len(slots) - 1) for qbit in cells if cells[qbit] != 's']
+                continue
+            for cells in groups:
+                slot = max([barrier] + [free[qbit] for qbit in cells])
+                while len(slots) <= slot: slots.append({})
+                slots[slot].update(cells)
+                for qbit in cells: free[qbit] = slot + 1
+                if index in symbolic:
+                    self.cells[index] += [(qbit, slot) for qbit in cells if cells[qbit] != 's']
+        if len(slots) == 0: slots.append({})
+        grid = [[slot.get(qbit, 'i') for slot in slots] for qbit in range(self.size)]
+        self.layout = (grid, measurements)
+        return self.layout
+
+    def depth(self):
+        """
+        :return: (int) The number of slots of the circuit
+        """
+        return len(self.getLayout()[0][0])
+
+    def compact(self):
+        """
+        Switches to the as soon as possible layout of getLayout, which packs the operations into
+        the fewest slots allowed by the order of the operations on each qubit and the measurements.
+
+        :return: (int, int) The number of slots before and after compaction
+        """
+        before = self.depth()
+        self.asap, self.layout = True, None
+        return before, self.depth()
@@ -5,7 +5,6 @@ This module presents all the necessary computations for the Grover's Algorithm a
 import QuantumCircuit
 import numpy as np
 import matplotlib.pyplot as plt
-import QuantumRegister
 import Sparse
 
 
@@ -51,12 +50,9 @@ def Grover_Circuit(n_qubits, measured_bits, plot_results=True):
     
     grover_circuit.addmeasure()
     # calculate oracle
-    elements = []
-    for i in range(2**n_qubits):
-        if i in measured_bits:
-            elements.append(Sparse.MatrixElement(i,i,-1))
-        else: elements.append(Sparse.MatrixElement(i,i,1))
-    oracle_gate = Sparse.SparseMatrix(2**n_qubits, elements) # Creates a sparseMatrix representation of the oracle
+    diagonal = np.ones(2**n_qubits)
+    diagonal[measured_bits] = -1
+    oracle_gate = Sparse.SparseMatrix.from_diagonal(diagonal) # Creates a sparseMatrix representation of the oracle
     #print(oracle_gate.makedense())
     
     #Add Oracle
@@ -109,11 +105,9 @@ def LazyGroverDemo(n_qubits, measured_bits, plot_results=True):
     
     grover_circuit.addmeasure()
     # calculate oracle
-    oracle = Sparse.ColMatrix(2**n_qubits)
-    for i in range(2**n_qubits):
-        if i in measured_bits:
-            oracle[i,i] = -1
-        else: oracle[i,i] = 1
+    diagonal = np.ones(2**n_qubits)
+    diagonal[measured_bits] = -1
+    oracle = Sparse.ColMatrix.from_diagonal(diagonal)
     #print('oracle is:')
     #print(oracle)
     #Add Oracle
@@ -259,22 +253,18 @@ def Ber_Vaz(s):
     bv_circ.show_results()
     #bv_circ.register.measure()
     
-    short_register = QuantumRegister.QuantumRegister(n)
-    short_register.setStateVec(bv_circ.register.Statevec.Elements[:2**n])
-    short_register.measure()
-    
-    
     print('Qubits of the Bernstein-Vazirani circuit:')
     for i, qbit in enumerate(bv_circ.register.Qbits):
         print(f'Qubit {i}')
         print(qbit)
     
-    print('Shortened register represented by:')
-    print(short_register)
-    print('Qubits of the shortened registered')
-    for i, qbit in enumerate(short_register.Qbits):
+    print('Data qubits represented by:')
+    for i, probability in enumerate(bv_circ.register.marginal([i for i in range(n)])):
+        print(f'|{i}> = {probability}')
+    print('Probabilities of the data qubits')
+    for i, (zero, one) in enumerate(bv_circ.register.marginals()[:n]):
         print(f'Qubit {i}')
-        print(qbit)
+        print(f'|0> = {zero} \n|1> = {one} \n')
     
     
 def qft_example():
@@ -6,26 +6,55 @@ import numpy as np
 import Simulator
 from Interface import Interface
 import LazySim
+import Fusion
+import BatchSim
+import ShardSim
+import Operations
+from Operations import Parameter
+from GateCache import peeked
 
 class QuantumCircuit(Interface):
-    def __init__(self, name, size):
+    def __init__(self, name, size, mapfile=None, dtype=complex):
         """
         Initiates the quantum circuit.
 
         :param name: (string) The name of the Quantum Circuit
         
         :param size: (int) The nuber of qubits in the Quantum Circuit
+
+        :param mapfile: (str) optional path of a file to keep the statevector in as a numpy.memmap.
+            Only lazysim and fusedsim stream through the file, the other simulators load the statevector into memory.
+
+        :param dtype: (numpy.dtype) The precision of the statevector, complex or numpy.complex64
         """
         super().__init__(name)
         self.size = size
         self.customgates = {}
-        self.register = QuantumRegister.QuantumRegister(size)
-        self.gates = []
-        for i in range(self.register.Qbits.size):
-            self.gates.append(['i'])
-        self.gateindex = 0
-        self.measurements = []
+        self.register = QuantumRegister.QuantumRegister(size, mapfile, dtype)
+        self.operations = Operations.OperationList(size)
         self.final_measurements = None
+
+    @property
+    def gates(self):
+        """
+        The gates of the circuit arranged in slots, with one row per qubit. It is worked out from 
+        the operations when needed, and should not be changed.
+        """
+        return self.operations.getLayout()[0]
+
+    @property
+    def measurements(self):
+        """
+        The slots of the circuit after which measurements are taken
+        """
+        return self.operations.getLayout()[1]
+
+    @property
+    def gateindex(self):
+        """
+        The last slot of the circuit
+        """
+        return len(self.gates[0]) - 1
         
     def setStateVector(self, newVector):
         """
@@ -45,55 +74,24 @@ class QuantumCircuit(Interface):
         :param bits: (list) The position of bits the gate is needed to be added
 
         """
-        # Check availability
-        available = True
-        for i in bits: 
-            if self.gates[i][self.gateindex]!='i':
-                available = False
-        if available:
-            for i in bits:
-                self.gates[i][self.gateindex] = gate
-        else:
-            for i in range(len(self.gates)): # Go through all rows of self.gates and add in the gate if needed, add in 'i' if not needed
-                if i in bits:
-                    self.gates[i].append(gate)
-                else:
-                    self.gates[i].append('i')
-            self.gateindex += 1
+        self.operations.addGate(gate, bits)
         
     def addBigGate(self, gate_info):
         """
-        Adds the representation of a gate into self.gates.
+        Adds the representation of a gate to the operations of the circuit.
         The gate will be iplemented later on when the circuit is simulated.
 
         :param gate_info: (tuple) The gate info for the large gate in the form of string(type of gate), and ints for control bits, then the controlled bit for the last int if needed.
 
         """
-        
-        if gate_info[0] == 'cp' or gate_info[0]=='ncp' or gate_info[0]=='custom':
-            low_lim, high_lim = min(gate_info[1:-1]), max(gate_info[1:-1])
-        else: low_lim, high_lim = min(gate_info[1:]), max(gate_info[1:])
-        
-        available = True
-        for i in range(low_lim, high_lim+1): 
-            if self.gates[i][self.gateindex]!='i':
-                available = False
-        if available:
-            self.gates[low_lim][self.gateindex] = gate_info
-            for i in range(low_lim+1, high_lim+1):
-                self.gates[i][self.gateindex] = 's'
-        else:
-            for i in range(len(self.gates)):
-                self.gates[i].append('i')
-            self.gateindex += 1
-            self.addBigGate(gate_info)
+        self.operations.addBigGate(gate_info)
     
     def r(self, bits, theta):
         """
         Adds a rotation matrix to the circuit
 
         :param bits: (list) The qubits that the matrices will be applied to
-        :param theta: (float) Rotation angle
+        :param theta: (float or Parameter) Rotation angle
 
         """
         self.addGate(('r', theta), bits)
@@ -124,7 +122,7 @@ class QuantumCircuit(Interface):
         Adds a phase gate controlled by n other qubits
 
         :param bits: (list) The control qubits
-        :param phi: (float) Rotation parameter
+        :param phi: (float or Parameter) Rotation parameter
 
         """
         gate_info = ['ncp']
@@ -156,7 +154,7 @@ class QuantumCircuit(Interface):
         :param name: (str) The name of the custom gate.
 
         """
-        assert max(qbit1, qbit2) <= len(self.gates), 'Gates not in the circuit'
+        assert max(qbit1, qbit2) <= self.size, 'Gates not in the circuit'
         assert 2**np.abs((qbit2 - qbit1)+1) == gate.Dimension, f'Dimensions of gate do not match the given qubits {2**np.abs(qbit2-qbit1)}'
         gate_info = ['custom', qbit1, qbit2, name]
         self.customgates.update({str(name) : gate})
@@ -168,7 +166,7 @@ class QuantumCircuit(Interface):
 
         :param qbit1: (int) Control bit 1
         :param qbit2: (int) Control bit 2
-        :param phi: (float) Rotation angle
+        :param phi: (float or Parameter) Rotation angle
 
         """
         self.addBigGate(('cp', qbit1, qbit2, phi))
@@ -183,13 +181,19 @@ class QuantumCircuit(Interface):
         """
         self.addBigGate(('swap', qbit1, qbit2))
         
-    def run_circuit(self, return_full=False):
+    def run_circuit(self, return_full=False, processes=None):
         """
         Applies the circuit to the initialized state vector
 
-        :return: The final state of the state vector. If return_full: returns all operations along with the statevector and measurements
+        :param processes: (int) optional number of processes, a power of two. The statevector is then split 
+            into one shard per process in shared memory and simulated with ShardSim.
+        :return: The final state of the state vector. If return_full: returns all operations along with the statevector and measurements.
+            With processes: returns the statevector and measurements
         
         """
+        if processes is not None:
+            self.register, self.final_measurements = ShardSim.Simulator(self.operations, self.register, self.customgates, self.measurements, processes).simulate()
+            return self.register, self.final_measurements
         if return_full: 
             self.register, operations, self.final_measurements = Simulator.Simulator(self.gates, self.register, self.customgates, self.measurements).simulate(return_full = True)
             return self.register, operations, self.final_measurements
@@ -205,15 +209,120 @@ class QuantumCircuit(Interface):
         self.register, self.final_measurements = Simulator.Simulator(self.gates, self.register, self.customgates, self.measurements).simulate2()
         return self.register, self.final_measurements
 
+    def fuseSingleGates(self):
+        """
+        Multiplies each run of single qubit gates on the same qubit into one gate before simulating,
+        removing the runs which multiply to the identity. Runs do not cross measurements.
+
+        :return: (int) The number of gate applications saved
+        """
+        return Fusion.fuseSingleGates(self)
+
+    def bind(self, values):
+        """
+        Gives values to the Parameters used as angles of r, cp and ncp gates. The circuit can be bound 
+        again with new values and simulated without building it again, as only the gates using the 
+        parameters are changed. The register is not reset.
+
+        :param values: (dict) The values of the parameters, keyed by Parameter or by name
+        """
+        self.operations.bind(values)
+
+    @property
+    def parameters(self):
+        """
+        The Parameters used by the gates of the circuit, by name
+        """
+        return self.operations.parameters()
+
+    def compact(self):
+        """
+        Packs the gates of the circuit into as few slots as possible. Each gate is moved to the earliest
+        slot after the gates before it on the same qubits and the last measurement, and controlled gates
+        no longer take up the qubits between their control and target qubits.
+
+        :return: (int, int) The depth of the circuit before and after compaction
+        """
+        return self.operations.compact()
+
+    def fusedsim(self, k=4, costmodel=None):
+        """
+        Groups neighbouring gates into blocks acting on at most k qubits, then applies each block 
+        to the statevector in one pass using the Lazy Matrix Implementation.
+        A real statevector is kept as floats when every gate of the circuit keeps it real.
+
+        :param k: (int) The largest number of qubits of a block
+        :param costmodel: (Fusion.CostModel) Decides when fusing gates pays off
+        :return: The register and any measurements made
+        """
+        compiled = Fusion.fuseBlocks(self, k, costmodel)
+        real = self.register.canMakeReal() and self.isReal() and self.register.makeReal()
+        self.register, self.final_measurements = compiled.simulate(self.register, self.measurements)
+        if real: self.__makeComplex()
+        return self.register, self.final_measurements
+
+    def isReal(self):
+        """
+        Checks whether simulating the circuit keeps the statevector of the register real. This holds when
+        the statevector has no imaginary parts and every gate has a real matrix, like the h, x, z, cnot, 
+        ccnot, cz, ncz and swap gates, r gates by multiples of pi and real custom gates. A gate with
+        a Parameter which has not been bound is not taken to be real. The gate cache is not changed.
+
+        :return: (bool) Whether the statevector stays real
+        """
+        for gate_info, qbit in self.operations:
+            if gate_info == 'measure': continue
+            if type(gate_info) == tuple and any(isinstance(value, Parameter) for value in gate_info): return False
+            gate = Simulator.lazyGate(gate_info, qbit, 2**self.size, self.customgates, peeked)
+            if gate is not None and not gate.isReal(): return False
+        # the statevector is read last, as it is the largest part to check
+        elements = self.register.Statevec.Elements
+        return not (np.iscomplexobj(elements) and np.any(elements.imag))
+
+    def __makeComplex(self):
+        """
+        Gives the register and measurements the precision of the register again after simulating a real statevector
+        """
+        self.register.makeComplex()
+        self.final_measurements[1] = [np.asarray(snapshot, dtype=self.register.Dtype) for snapshot in self.final_measurements[1]]
+
+    def batchsim(self, states=None, params=None):
+        """
+        Simulates the circuit on a batch of initial statevectors, or with a batch of values for its 
+        Parameters, applying each gate to the whole batch at once. The register is not changed.
+
+        :param states: (list or numpy.ndarray) The initial statevectors, one per item of the batch, which are
+            normalised. Defaults to the statevector of the register for every item.
+        :param params: (dict or list) The values of the Parameters for each item of the batch, either
+            as a list of values by parameter or as a list of dictionaries, one per item. A single value
+            by parameter is used for every item.
+        :return: (numpy.ndarray) The (batch, 2^n) array of final statevectors
+        :return: (list) The measurements in the same form as the other simulators, with a (batch, 2^n) 
+            array of statevectors for each measurement
+        """
+        if params is None: params = {}
+        if type(params) != dict:
+            params = {key: [item[key] for item in params] for key in (params[0] if len(params) > 0 else {})}
+        values = {(key.name if isinstance(key, Parameter) else key): np.asarray(value, dtype=float) for key, value in params.items()}
+        assert all(value.ndim <= 1 for value in values.values()), 'Parameters take one value, or one value per item of the batch'
+        batch = [value.size for value in values.values() if value.ndim == 1]
+        if states is None:
+            states = np.tile(self.register.Statevec.Elements, (batch[0] if len(batch) > 0 else 1, 1))
+        states = np.array(states, dtype=self.register.Dtype).reshape(-1, 2**self.size)
+        states /= np.sqrt((states*states.conj()).real.sum(axis=1))[:, None]
+        assert all(size == states.shape[0] for size in batch), 'Batch sizes of states and parameters do not match'
+        # a single value is given to every item of the batch
+        values = {name: np.broadcast_to(np.atleast_1d(value), states.shape[:1]) for name, value in values.items()}
+        final, snapshots = BatchSim.BatchSimulator(self.operations, states, self.customgates, values).simulate()
+        self.final_measurements = [self.measurements, snapshots]
+        return final, self.final_measurements
+
     def addmeasure(self):
         """
         Adds a space where a measurement should be made. Mesurements are only made when simulating the circuit.
 
         """
-        self.measurements.append(self.gateindex)
-        for i in range(len(self.gates)):
-            self.gates[i].append('i')
-        self.gateindex += 1
+        self.operations.addMeasure()
 
     def show_results(self):
         """
@@ -244,8 +353,11 @@ class QuantumCircuit(Interface):
     def lazysim(self):
         """
         Uses Lazy Matrix Implementation for the Simulator.
+        A real statevector is kept as floats when every gate of the circuit keeps it real.
         """
+        real = self.register.canMakeReal() and self.isReal() and self.register.makeReal()
         self.register, self.final_measurements = LazySim.Simulator(self.gates, self.register, self.customgates, self.measurements).simulate()
+        if real: self.__makeComplex()
         return self.register, self.final_measurements
     
 if __name__ == '__main__':
@@ -11,14 +11,26 @@ class QuantumRegister:
     in state 0 and initializes the wavevector which describes the register.
 
     :param n: (int) length of register
+    :param mapfile: (str) optional path of a file holding the statevector as a numpy.memmap, for registers 
+        too large for memory. The lazy simulators then apply gates to it a chunk at a time.
+    :param dtype: (numpy.dtype) The precision of the statevector, complex or numpy.complex64 which 
+        halves its memory at the cost of accuracy
 
     """
-    def __init__(self, n):
+    # whether makeReal may keep a real statevector as floats while simulating
+    RealStates = True
+
+    def __init__(self, n, mapfile=None, dtype=complex):
         Qbits = []
 
         for i in range(n): 
             Qbits.append(Qubit())
         self.Qbits = np.array(Qbits)
+        self.Mapfile = mapfile
+        self.Dtype = np.dtype(dtype)
+        self.Statevec = None
+        # the complex statevector kept aside while makeReal keeps the amplitudes as floats
+        self.Complex = None
         self.initialize()        
 
     def __str__(self):        
@@ -32,11 +44,73 @@ class QuantumRegister:
     
     def initialize(self):
         """
-        Sets the statevector according to the current state of qubits
+        Sets the statevector according to the current state of qubits. The product of the qubits is written
+        straight into the buffer of the statevector, which is reused when it has the precision of the register.
+        """
+        elements = self.__buffer()
+        n = self.Qbits.size
+        if self.Mapfile is None: return self.__product(elements, self.Qbits)
+        # the qubits below ChunkQubits give the amplitudes inside a chunk and the higher qubits give a factor for each chunk
+        c = min(n, Sparse.LazyMatrix.ChunkQubits)
+        low, high = np.empty(2**c, dtype=self.Dtype), np.empty(2**(n-c), dtype=self.Dtype)
+        self.__product(low, self.Qbits[:c])
+        self.__product(high, self.Qbits[c:])
+        for chunk, factor in enumerate(high):
+            np.multiply(low, factor, out=elements[chunk*low.size:(chunk+1)*low.size])
+
+    def __product(self, elements, qbits):
+        """
+        Writes the product state of some qubits into an array, with qubit k giving bit k of the index.
+        The array is filled from the lowest qubit up, each qubit doubling the part already filled, 
+        so no intermediate vectors are made.
+
+        :param elements: (numpy.ndarray) The array of 2^len(qbits) amplitudes
+        :param qbits: (list) The qubits
+        """
+        elements[0] = 1
+        for k, qbit in enumerate(qbits):
+            zero, one = qbit.vals.Elements
+            np.multiply(elements[:2**k], one, out=elements[2**k:2**(k+1)])
+            elements[:2**k] *= zero
+
+    def __buffer(self):
+        """
+        Finds the array to write a new statevector into. The elements of the statevector are reused while
+        they have the precision of the register, otherwise a new vector or memmap file is made.
+
+        :return: (numpy.ndarray) The elements of the statevector
         """
-        self.Statevec = Sparse.Vector(np.array([1], dtype=complex))
-        for qbit in self.Qbits[::-1]:
-            self.Statevec = self.Statevec.outer(qbit.vals)
+        n = self.Qbits.size
+        if self.Statevec is not None and self.Statevec.Elements.dtype == self.Dtype and self.Statevec.Dimension == 2**n:
+            return self.Statevec.Elements
+        if self.Mapfile is not None: self.Statevec = Sparse.Vector.wrap(np.memmap(self.Mapfile, dtype=self.Dtype, mode='w+', shape=(2**n,)))
+        else: self.Statevec = Sparse.Vector.empty(2**n, self.Dtype)
+        return self.Statevec.Elements
+
+    def setBasisState(self, state):
+        """
+        Sets the register to a basis state, zeroing the statevector in place and writing its one non zero amplitude.
+        The qubits are set to match.
+
+        :param state: (int or str) The index of the basis state, or its bitstring whose last character is the value of qubit 0
+        """
+        if type(state) == str: state = int(state, 2)
+        n = self.Qbits.size
+        assert 0 <= state < 2**n, 'Basis state outside the register'
+        for k, qbit in enumerate(self.Qbits):
+            qbit.vals.Elements[:] = (0, 1) if (state >> k) & 1 else (1, 0)
+        elements = self.__buffer()
+        elements.fill(0)
+        elements[state] = 1
+
+    def reset(self, state=0):
+        """
+        Puts the register back into a basis state, all qubits 0 by default, reusing the buffer of the statevector.
+        Simulating the same circuit again after a reset allocates no new statevector.
+
+        :param state: (int or str) The basis state, as for setBasisState
+        """
+        self.setBasisState(state)
             
     def setStateVec(self, newVec):
         """
@@ -47,8 +121,53 @@ class QuantumRegister:
         newVec = np.array(newVec, dtype=complex)
         assert self.Statevec.Dimension == newVec.size, 'Wrong dimensions for new statevector'
         normal_const = np.sqrt((newVec*newVec.conj()).sum())
-        self.Statevec = Sparse.Vector(newVec/normal_const)
+        # the statevector is written in place when it can be, keeping its spare buffer
+        if self.Mapfile is not None or self.Statevec.Elements.dtype == self.Dtype: self.Statevec.Elements[:] = newVec/normal_const
+        else: self.Statevec = Sparse.Vector(newVec/normal_const, self.Dtype)
         
+    def canMakeReal(self):
+        """
+        Checks the conditions of makeReal which do not read the amplitudes, so that simulators can skip
+        looking at the circuit and statevector when the statevector cannot be kept as floats
+
+        :return: (bool) Whether RealStates is on and the statevector is not kept in a numpy.memmap
+        """
+        return self.RealStates and not isinstance(self.Statevec.Elements, np.memmap)
+
+    def makeReal(self):
+        """
+        Keeps the statevector as floats, float64 for complex and float32 for complex64, when none of its
+        amplitudes has an imaginary part, so that the lazy kernels work on half as much data. The floats 
+        and their spare buffer are the two halves of the spare buffer of the complex statevector, which 
+        is put back by makeComplex, so no new statevector is allocated once the spare buffer exists.
+
+        :return: (bool) Whether the statevector is now kept as floats
+        """
+        elements = self.Statevec.Elements
+        if not self.canMakeReal(): return False
+        if not np.iscomplexobj(elements): return True
+        if np.any(elements.imag): return False
+        halves = self.Statevec.spare().view(elements.real.dtype).reshape(2, -1)
+        halves[0] = elements.real
+        self.Complex = self.Statevec
+        self.Statevec = Sparse.Vector.wrap(halves[0], shared=False)
+        self.Statevec.Spare = halves[1]
+        return True
+
+    def makeComplex(self):
+        """
+        Keeps the statevector with the precision of the register again after makeReal, writing the floats
+        back into the complex statevector
+        """
+        elements = self.Statevec.Elements
+        if elements.dtype != self.Dtype:
+            if self.Complex is None: self.Statevec = Sparse.Vector(elements, self.Dtype)
+            else:
+                self.Complex.Elements.real = elements
+                self.Complex.Elements.imag = 0
+                self.Statevec = self.Complex
+        self.Complex = None
+
     def setQbits(self, qbits, vals):
         """
         Sets the initial values of the qubits if required,
@@ -63,21 +182,99 @@ class QuantumRegister:
             self.Qbits[qbit].vals = Sparse.Vector(np.array(vals[qbit]) / np.linalg.norm(vals[qbit]))
         self.initialize()
 
+    def marginals(self):
+        """
+        Finds the probability of measuring each qubit as 0 or 1, without changing the qubits.
+        The probabilities of the statevector are viewed as a (2,...,2) array, with qubit j on 
+        axis n-1-j, and summed over the axes of the other qubits.
+
+        :return: (numpy.ndarray) Array of shape (n, 2), row j holds the probabilities of qubit j being 0 and 1
+        """
+        n = self.Qbits.size
+        psi = self.Statevec.Elements
+        probabilities = (psi*psi.conj()).real.reshape((2,)*n)
+        axes = tuple(range(n))
+        return np.array([probabilities.sum(axis=axes[:n-1-j] + axes[n-j:]) for j in range(n)]).reshape(n, 2)
+
+    def marginal(self, qubits):
+        """
+        Finds the probabilities of the basis states of some of the qubits, summing over the others.
+        The real and imaginary parts of the statevector are viewed as (2,...,2) arrays and each is 
+        contracted with itself over the axes of the other qubits, so no array the size of the 
+        statevector is made.
+
+        :param qubits: (list) The qubits kept, bit k of the index of the result gives the value of qubits[k]
+        :return: (numpy.ndarray) The 2^len(qubits) probabilities
+        """
+        n = self.Qbits.size
+        qubits = list(qubits)
+        psi = self.Statevec.Elements.reshape((2,)*n)
+        # the kept axes, most significant first, so the last of qubits is first
+        kept = [n - 1 - q for q in qubits[::-1]]
+        probabilities = np.einsum(psi.real, list(range(n)), psi.real, list(range(n)), kept)
+        if np.iscomplexobj(psi):
+            probabilities += np.einsum(psi.imag, list(range(n)), psi.imag, list(range(n)), kept)
+        return probabilities.reshape(2**len(qubits))
+
+    def reduced_density_matrix(self, qubits):
+        """
+        Finds the density matrix of some of the qubits, tracing out the others. The statevector is viewed 
+        as a (2,...,2) array and contracted with itself over the axes of the other qubits. The real and 
+        imaginary parts are contracted as views of the statevector, so no conjugated copy of it is made.
+
+        :param qubits: (list) The qubits kept, bit k of the row and column index gives the value of qubits[k]
+        :return: (numpy.ndarray) The 2^len(qubits) by 2^len(qubits) density matrix
+        """
+        n = self.Qbits.size
+        qubits = list(qubits)
+        m = len(qubits)
+        psi = self.Statevec.Elements.reshape((2,)*n)
+        # the kept axes give the rows for the first factor and the columns for the second, most significant first
+        rows = [n - 1 - q for q in qubits[::-1]]
+        cols = [n + axis for axis in rows]
+        second = [n + axis if axis in rows else axis for axis in range(n)]
+        def contract(a, b):
+            return np.einsum(a, list(range(n)), b, second, rows + cols).reshape(2**m, 2**m)
+        rho = contract(psi.real, psi.real).astype(complex)
+        if np.iscomplexobj(psi):
+            rho += contract(psi.imag, psi.imag)
+            # the imaginary part is y x^T - x y^T, with x y^T the transpose of y x^T
+            cross = contract(psi.imag, psi.real)
+            rho += 1j*(cross - cross.T)
+        return rho
+
     def measure(self):
         """
         Attempts to measure the current statevector in terms of individual qubits
         """
-        for qbit in self.Qbits:
-            qbit.vals.Elements[1] = 0+0j
-        for i, value in enumerate(self.Statevec.Elements):
-            for j, qbit in enumerate(self.Qbits):
-                if ((i>>(j)) & 1) == 1:
-                    #print(i,j,value)
-                    qbit.vals.Elements[1] += value*value.conj()
-        for qbit in self.Qbits:
-            qbit.vals.Elements[0] = complex(1 - qbit.vals.Elements[1])
+        marginals = self.marginals()
+        for qbit, (zero, one) in zip(self.Qbits, marginals):
+            qbit.vals.Elements[1] = complex(one)
+            qbit.vals.Elements[0] = complex(1 - one)
             qbit.normalize()
-            
+
+    def sample(self, shots, qubits=None, seed=None):
+        """
+        Measures the statevector many times without collapsing it. The cumulative distribution of the
+        basis states is built once and all of the shots are drawn from it with a binary search.
+
+        :param shots: (int) The number of measurements
+        :param qubits: (list) The qubits which are measured, defaults to all of them
+        :param seed: (int) Seed for the random number generator
+        :return: (dict) The number of times each result was measured, keyed by bitstring. The last
+            character of the bitstring is the value of the first qubit measured.
+        """
+        if qubits is None: qubits = range(self.Qbits.size)
+        qubits = np.array(qubits, dtype=np.int64)
+        psi = self.Statevec.Elements
+        cdf = np.cumsum((psi*psi.conj()).real, dtype=float)
+        draws = np.random.default_rng(seed).random(shots) * cdf[-1]
+        states = np.minimum(np.searchsorted(cdf, draws, side='right'), cdf.size - 1)
+        # the bits of the measured qubits, with the first qubit as the lowest bit
+        results = (((states[:, None] >> qubits) & 1) << np.arange(qubits.size)).sum(axis=1)
+        values, counts = np.unique(results, return_counts=True)
+        return {format(value, f'0{qubits.size}b'): int(count) for value, count in zip(values, counts)}
+
 class Qubit:
     """
     Creates a qubit using sparse matrices.
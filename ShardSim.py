@@ -0,0 +1,155 @@
+"""
+This module simulates a circuit with a pool of processes. The statevector is kept in multiprocessing.shared_memory
+and split into 2^g shards by its g highest qubits, the global qubits, with one shard for each process.
+A gate on the other, local, qubits is applied by every process to its own shard without any communication.
+Before a gate acts on a global qubit it is swapped with a local qubit the gate does not use, by exchanging
+halves of pairs of shards, so that the gate becomes local. Diagonal gates never need a swap, as each shard
+applies the entries of the diagonal matching its global qubits.
+"""
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import Sparse
+from Simulator import lazyGate
+
+# the shards of the statevector and the shared memory holding them, in each process of the pool
+shards = None
+memory = None
+
+def attach(name, count, size, dtype):
+    """
+    Finds the shards of the statevector in the shared memory, when a process of the pool starts
+
+    :param name: (str) The name of the shared memory
+    :param count: (int) The number of shards
+    :param size: (int) The number of amplitudes of each shard
+    :param dtype: (numpy.dtype) The precision of the statevector
+    """
+    global shards, memory
+    memory = shared_memory.SharedMemory(name=name)
+    shards = np.ndarray((count, size), dtype=dtype, buffer=memory.buf)
+
+def applyGate(task):
+    """
+    Applies a gate to one shard, with the scratch buffer of the process as its spare buffer
+
+    :param task: (tuple) The lazy gate acting on the local qubits and the index of the shard
+    """
+    gate, shard = task
+    block = Sparse.Vector.wrap(shards[shard])
+    block.Spare = Sparse.scratchBuffer(block.Dimension, shards.dtype)
+    gate.apply(block, out=block)
+
+def swapHalves(task):
+    """
+    Exchanges the amplitudes of two shards which differ in a global qubit, swapping that global qubit
+    with a local qubit. The amplitudes of the first shard with the local qubit set are exchanged with
+    those of the second shard with the local qubit not set.
+
+    :param task: (tuple) The shard with the global qubit not set, the shard with it set and the local qubit
+    """
+    first, second, qbit = task
+    low = shards[first].reshape(-1, 2, 2**qbit)
+    high = shards[second].reshape(-1, 2, 2**qbit)
+    low[:, 1, :], high[:, 0, :] = high[:, 0, :], low[:, 1, :].copy()
+
+
+class Simulator():
+    def __init__(self, operations, register, custom, measurements, processes):
+        """
+        Initialiser for the sharded simulator.
+
+        :param operations: (OperationList) The operations of the Quantum Circuit.
+        :param register: (QuantumRegister) The Quantum Register.
+        :param custom: (dict) Dictionary of user defined custom gates.
+        :param measurements: (list) The slots after which measurements are taken.
+        :param processes: (int) The number of processes and shards, a power of two.
+        """
+        self.operations = operations
+        self.register = register
+        self.customgates = custom
+        self.measurements = [measurements, []]
+        self.size = operations.size
+        self.processes = processes
+        self.globals = int(np.log2(processes))
+        assert 2**self.globals == processes, 'The number of processes must be a power of two'
+        assert self.globals < self.size, 'More shards than amplitudes'
+        self.local = self.size - self.globals
+        self.dtype = register.Dtype
+        # the qubit of the stored statevector holding each qubit of the circuit, changed by swaps
+        self.where = list(range(self.size))
+
+    def __swap(self, pool, p, q):
+        """
+        Swaps a global qubit of the stored statevector with a local qubit
+
+        :param pool: (multiprocessing.Pool) The processes
+        :param p: (int) The global qubit
+        :param q: (int) The local qubit
+        """
+        bit = 1 << (p - self.local)
+        pool.map(swapHalves, [(shard, shard | bit, q) for shard in range(self.processes) if not shard & bit])
+        a, b = self.where.index(p), self.where.index(q)
+        self.where[a], self.where[b] = q, p
+
+    def __apply(self, pool, gate):
+        """
+        Applies a lazy gate acting on the qubits of the circuit to the shards
+
+        :param pool: (multiprocessing.Pool) The processes
+        :param gate: (Gate, DiagonalGate or PermutationGate) The gate, acting on the whole statevector
+        """
+        positions = [self.where[q] for q in gate.qbpos]
+        if type(gate) == Sparse.DiagonalGate:
+            whole = gate.relocate(2**self.size, positions)
+            tasks = [(whole.block(self.local, shard), shard) for shard in range(self.processes)]
+            tasks = [(part, shard) for part, shard in tasks if part is not None]
+        else:
+            free = [q for q in range(self.local - 1, -1, -1) if q not in positions]
+            assert len(free) >= sum(p >= self.local for p in positions), 'Gate acts on more qubits than each shard holds'
+            for k, p in enumerate(positions):
+                if p >= self.local:
+                    positions[k] = free.pop(0)
+                    self.__swap(pool, p, positions[k])
+            part = gate.relocate(2**self.local, positions)
+            tasks = [(part, shard) for shard in range(self.processes)]
+        for part, shard in tasks: part.Workers = 1
+        pool.map(applyGate, tasks)
+
+    def __state(self, stored):
+        """
+        Puts the qubits of the stored statevector back in the order of the circuit
+
+        :param stored: (numpy.ndarray) The shards
+        :return: (numpy.ndarray) A copy of the statevector
+        """
+        n = self.size
+        axes = [n - 1 - self.where[n - 1 - i] for i in range(n)]
+        state = np.empty(2**n, dtype=self.dtype)
+        state.reshape((2,)*n)[...] = np.transpose(stored.reshape((2,)*n), axes)
+        return state
+
+    def simulate(self):
+        """
+        Applies the circuit to the register with a pool of processes sharing the statevector
+
+        :return: The register and any measurements made
+        """
+        memory = shared_memory.SharedMemory(create=True, size=2**self.size * self.dtype.itemsize)
+        try:
+            stored = np.ndarray((self.processes, 2**self.local), dtype=self.dtype, buffer=memory.buf)
+            stored[:] = np.asarray(self.register.Statevec.Elements).reshape(stored.shape)
+            with multiprocessing.Pool(self.processes, initializer=attach, initargs=(memory.name, self.processes, 2**self.local, self.dtype)) as pool:
+                for gate_info, qbit in self.operations:
+                    if gate_info == 'measure':
+                        self.measurements[1].append(self.__state(stored))
+                        continue
+                    gate = lazyGate(gate_info, qbit, 2**self.size, self.customgates)
+                    if gate is not None: self.__apply(pool, gate)
+            final = self.__state(stored)
+            del stored
+        finally:
+            memory.close()
+            memory.unlink()
+        self.register.setStateVec(final)
+        return self.register, self.measurements
@@ -3,6 +3,37 @@ This module simulates a circuit. It also defines the necessary gates.
 """
 import numpy as np
 import Sparse
+from GateCache import compiled
+
+def lazyGate(gate_info, qbit, size, customgates, compiled=compiled):
+    """
+    Creates the lazy gate which applies a gate of the circuit to the whole statevector.
+    Diagonal and permutation gates are recognised so that they are applied by multiplying 
+    or moving amplitudes.
+
+    :param gate_info: (str or tuple) The gate as stored in the circuit
+    :param qbit: (int) The lowest qubit the gate acts on
+    :param size: (int) The dimension of the statevector
+    :param customgates: (dict) Dictionary of user defined custom gates
+    :param compiled: (function) Finds the compiled matrices of a gate, from the cache of GateCache by default
+    :return: (Gate, DiagonalGate or PermutationGate) The gate, or None for the identity
+    """
+    if type(gate_info) != tuple:
+        if gate_info == 'i': return None
+        return compiled(gate_info).lazyGate(size, [qbit])
+    if gate_info[0]=='r':
+        return compiled('r', gate_info[1:]).lazyGate(size, [qbit])
+    elif gate_info[0]=='cn' or gate_info[0]=='ccn':
+        controls = list(gate_info[1:-1])
+        return compiled(gate_info[0], (), len(controls)+1).lazyGate(size, [gate_info[-1]] + controls)
+    elif gate_info[0]=='swap':
+        return compiled('swap', (), 2).lazyGate(size, list(gate_info[1:]))
+    elif gate_info[0]=='cz' or gate_info[0]=='ncz':
+        return compiled(gate_info[0], (), len(gate_info)-1).lazyGate(size, list(gate_info[1:]))
+    elif gate_info[0]=='cp' or gate_info[0]=='ncp':
+        return compiled(gate_info[0], gate_info[-1:], len(gate_info)-2).lazyGate(size, list(gate_info[1:-1]))
+    elif gate_info[0]=='custom':
+        return Sparse.makeGate(size, customgates[gate_info[-1]], list(range(gate_info[1], gate_info[2]+1)))
 
 class Simulator():
     def __init__(self, gates, register, custom, measurements):
@@ -16,222 +47,76 @@ class Simulator():
         """
         self.gates = gates
         self.register = register
-        self.singlegates = {'x' : np.array([[0,1], [1,0]]),
-                      'y' : np.array([[0,-1j], [1j,0]]),
-                      'z' : np.array([[1,0], [0,-1]]),
-                      'h' : np.array([[1,1],[1,-1]])/np.sqrt(2),
-                      'p' : np.array([[1,0],[0,1j]]),
-                      't' : np.array([[1,0],[0,np.exp(1j*np.pi/4)]]),
-                      'i' : np.eye(2)
-                      }
         self.customgates = custom
         self.measurements = [measurements, []]
 
-    def __bitactive(self, n, bit):
-        """
-        Checks whether a given integer has a particular bit active
-
-        :param n: (int) Integer to check
-        :param bit: (int) The position of the bit to check
-        :return: (Boolean) True of bit is active, false if not
-        """
-        return ((n>>(bit)) & 1) == 1
-        
-    def __toggle(self, n, bit):
-        """
-        Toggles a specific bit in an integer
-
-        :param n: (int) Integer to toggle
-        :param bit: (int) The position of the bit to toggle
-        :return: (int) The new integer created by toggling the bit
-        """
-        return n ^ (1 << bit)
-    
-    def __cNot(self, gate_info):
-        """
-        Creates an arbitrary sized controlled not gate between two arbitrary qbits.
-
-        :param gate_info: (tuple(int, int)) Position in the circuit of the control qubit and the controlled qubit
-        :return: (SparseMatrix) The cnot gate entangling the two qubits given.
-        """
-        qbit1, qbit2 = gate_info
-            
-        if qbit1>qbit2:
-            control_bit = np.abs(qbit2-qbit1)
-            controlled_bit = 0
-        else:
-            control_bit = 0
-            controlled_bit = qbit2 - qbit1
-            
-        elements = [Sparse.MatrixElement(0,0,1)]
-        dimension = 2**(np.abs(qbit2-qbit1)+1)
-        for i in range(1, dimension):
-            if self.__bitactive(i, control_bit):
-                col = self.__toggle(i, controlled_bit)
-                elements.append(Sparse.MatrixElement(i, col, 1))
-            else: elements.append(Sparse.MatrixElement(i,i,1))
-        return Sparse.SparseMatrix(dimension, elements)
-    
-    def __ccNot(self, gate_info):
-        """
-        Creates a Sparsematrix representing the controlled-controlled-not (ccnot or Tiffoli) 
-        gate for the given qubits. Can be applied to any exisiting qubits.
-
-        :param gate_info: (tuple(int, int, int)) first, second qubit controlling the gate and the qubit controlled by the other two
-        :return: (SparseMatrix)  Matrix representation of the gate
-        """
-        control1, control2, qbit3 = gate_info
-        # Reset the values to range from 0 to maxval
-        minval = min(control1, control2, qbit3)
-        maxval = max(control1, control2, qbit3) - minval
-        control1 = control1 - minval
-        control2 = control2 - minval
-        qbit3 = qbit3 - minval
-            
-        # Create elements and calculate dimensions
-        elements = [Sparse.MatrixElement(0,0,1)]
-        dimension = 2**(maxval+1)
-            
-        # For each possible bit check whether the control qubits are active
-        for i in range(1, dimension):
-            if self.__bitactive(i, control1) and self.__bitactive(i, control2):
-                # if control qubits are active, calculate the new value and insert into matrix
-                col = self.__toggle(i, qbit3)
-                elements.append(Sparse.MatrixElement(i, col, 1))
-            else: elements.append(Sparse.MatrixElement(i,i,1))
-        return Sparse.SparseMatrix(dimension, elements)
-    
-    def __cZ(self, gate_info):
+    def __addLargeGate(self, gate_info):
         """
-        Creates a controlled z gate given 2 qubits
+        Helper function for makeMatrices(). Finds the matrix of the larger gates which cannot be 
+        applied as a lazy gate, which are the custom gates that are not diagonal or permutations.
 
-        :param gate_info: (tuple(int, int)) The two gates to control the z
-        :return: (SparseMatrix) Representation of the cz gate
+        :param gate_info: (tuple) information of multi-qubit gate
+        :return: (SparseMatrix) Matrix representation of the operation for the gates given.
         """
-        qbit1, qbit2 = gate_info
-        shift = min(qbit1, qbit2)
-        qbit1 = qbit1 - shift
-        qbit2 = qbit2 - shift
-            
-        elements = [Sparse.MatrixElement(0,0,1)]
-        dimension = 2**(np.abs(qbit2-qbit1)+1)
-        for i in range(1, dimension):
-            if self.__bitactive(i, qbit1) and self.__bitactive(i, qbit2):
-                elements.append(Sparse.MatrixElement(i, i, -1))
-            else: elements.append(Sparse.MatrixElement(i,i,1))
-        return Sparse.SparseMatrix(dimension, elements)
+        operation = self.customgates[gate_info[-1]]
+        if type(operation) == Sparse.ColMatrix: operation = operation.toSparse()
+        return operation
     
-    def __cP(self, gate_info):
+    def __lazyGate(self, gate_info, qbit):
         """
-        Creates a controlled phase gate for the given qubits
+        Creates the lazy gate for a gate if its matrix is diagonal or a permutation, so that it can be 
+        applied by multiplying or moving amplitudes rather than as part of the matrix for its slot.
 
-        :param gate_info: (tuple(int, int, float)) The information supplied to the gate. Control qubits as ints, float as the phase.
-        :return: (SparseMatrix) Representation of the cp gate
-        """
-        qbit1, qbit2, phi = gate_info
-        
-        elements = [Sparse.MatrixElement(0,0,1)]
-        dimension = 2**(np.abs(qbit2-qbit1)+1)
-        for i in range(1, dimension):
-            if self.__bitactive(i, qbit1) and self.__bitactive(i, qbit2):
-                elements.append(Sparse.MatrixElement(i, i, np.exp(1j*phi)))
-            else: elements.append(Sparse.MatrixElement(i,i,1))
-        return Sparse.SparseMatrix(dimension, elements)
-        
-    def __NCP(self, gate_info):
-        """
-        Adds a phase gate controlled by an arbitrary number of bits
-    
-        :param gate_info: (tuple(int, int, int..., float)) Control qubits as ints, phase as a float.
-        :return: (SparseMatrix) Matrix representation of gate.
+        :param gate_info: (str or tuple) The gate as stored in the circuit
+        :param qbit: (int) The lowest qubit the gate acts on
+        :return: (DiagonalGate or PermutationGate) The gate, or None if it must be part of the slot matrix
         """
-        bits = np.array(gate_info[:-1])
-        bits = bits - min(bits)
-        phi = gate_info[-1]
-        
-        elements = [Sparse.MatrixElement(0,0,1)]
-        dimension = 2**(max(bits)-min(bits)+1)
-        for i in range(1, dimension):
-            active = True
-            for bit in bits:
-                if not self.__bitactive(i, bit):
-                    active = False
-                    break
-            if active: elements.append(Sparse.MatrixElement(i, i, np.exp(1j*phi)))
-            else: elements.append(Sparse.MatrixElement(i, i, 1))
-        return Sparse.SparseMatrix(dimension, elements)
-    
-    def __NCZ(self, gate_info):
-        """
-        Adds a z gate controlled by an arbitrary number of bits
-    
-        :param gate_info: (tuple(int, int, int...,)) Control qubits as ints, arbitrary number
-        :return: (SparseMatrix) Matrix representatin of the gate
-        """
-        bits = np.array(gate_info)
-        bits = bits - min(bits)
-        
-        elements = [Sparse.MatrixElement(0,0,1)]
-        dimension = 2**(max(bits)-min(bits)+1)
-        for i in range(1, dimension):
-            active = True
-            for bit in bits:
-                if not self.__bitactive(i, bit):
-                    active = False
-                    break
-            if active: elements.append(Sparse.MatrixElement(i, i, -1))
-            else: elements.append(Sparse.MatrixElement(i, i, 1))
-        return Sparse.SparseMatrix(dimension, elements)
+        gate = lazyGate(gate_info, qbit, 2**self.register.Qbits.size, self.customgates)
+        if type(gate) == Sparse.Gate: return None
+        return gate
     
-    def __Swap(self, gate_info):
+    def __span(self, gate_info):
         """
-        Creates the matrix representing the swap operation between two qubits.
+        Finds the number of qubits covered by a gate in the circuit
 
-        :param gate_info: (tuple(int, int)) The two gates to be swapped.
-        :return: (SparseMatrix) Matrix representation of the swap gate.
-        """
-        qbit1, qbit2 = gate_info
-        shift = min(qbit1, qbit2)
-        qbit1 = qbit1 - shift
-        qbit2 = qbit2 - shift
-        elements = []
-        dimension = 2**(np.abs(qbit2-qbit1)+1)
-        for i in range(0, dimension):
-            col = i
-            if (self.__bitactive(i, qbit1) and not self.__bitactive(i, qbit2)) or (not self.__bitactive(i, qbit1) and self.__bitactive(i, qbit2)):
-                col = self.__toggle(self.__toggle(i, qbit1), qbit2)
-            elements.append(Sparse.MatrixElement(i, col, 1))
-            
-        return Sparse.SparseMatrix(dimension, elements)
+        :param gate_info: (str or tuple) The gate as stored in the circuit
+        :return: (int) The number of qubits from the lowest to the highest one the gate acts on
+        """
+        if type(gate_info) != tuple or gate_info[0]=='r': return 1
+        if gate_info[0]=='cp' or gate_info[0]=='ncp' or gate_info[0]=='custom':
+            bits = gate_info[1:-1]
+        else: bits = gate_info[1:]
+        return max(bits) - min(bits) + 1
     
-    def __addLargeGate(self, gate_info):
+    def __makeSlot(self, slot):
         """
-        Helper function for makeMatrices(). Calls the creators for the larger gates based
-        info provided.
+        Creates the operator for one slot of the circuit. The gates in a slot act on different 
+        qubits, so the diagonal and permutation gates are taken out of the tensor product and 
+        applied on their own. Their other qubits are marked 's' and the qubits in between them 
+        may hold other gates of the slot.
 
-        :param gate_info: (tuple) information of multi-qubit gate
-        :return: (SparseMatrix) Matrix representation of the operation for the gates given.
-        """
-        if gate_info[0]=='r':
-            operation = self.__Rt(complex(gate_info[1]))
-        elif gate_info[0]=='cn':
-            operation = self.__cNot(gate_info[1:])
-        elif gate_info[0]=='ccn':
-            operation = self.__ccNot(gate_info[1:])
-        elif gate_info[0]=='swap':
-            operation = self.__Swap(gate_info[1:])
-        elif gate_info[0]=='cz':
-            operation = self.__cZ(gate_info[1:])
-        elif gate_info[0]=='cp':
-            operation = self.__cP(gate_info[1:])
-        elif gate_info[0]=='ncp':
-            operation = self.__NCP(gate_info[1:])
-        elif gate_info[0]=='ncz':
-            operation = self.__NCZ(gate_info[1:])
-        elif gate_info[0]=='custom':
-            operation = self.customgates[gate_info[-1]]
-        
-        return operation
+        :param slot: (list) The gates of the slot, one entry per qubit
+        :return: (SparseMatrix, KronMatrix or LazyProduct) The operator for the slot
+        """
+        bigmat = Sparse.SparseMatrix(1, [Sparse.MatrixElement(0,0,1)])
+        lazygates = []
+        filled = 0 # number of qubits already in the tensor product
+        for qbit, j in enumerate(slot):
+            if qbit < filled: continue
+            lazygate = None if j == 's' else self.__lazyGate(j, qbit)
+            if lazygate is not None or j == 's':
+                if lazygate is not None: lazygates.append(lazygate)
+                bigmat = compiled('i').sparse().tensorProduct(bigmat)
+                filled = qbit + 1
+            elif type(j)==tuple:
+                bigmat = self.__addLargeGate(j).tensorProduct(bigmat)
+                filled = qbit + self.__span(j)
+            else: 
+                bigmat = compiled(j).sparse().tensorProduct(bigmat)
+                filled = qbit + 1
+        if len(lazygates) == 0: return bigmat
+        if not bigmat.isIdentity(): lazygates.insert(0, bigmat)
+        return Sparse.LazyProduct(bigmat.Dimension, lazygates)
         
     def makeMatrices(self):
         """
@@ -243,26 +128,10 @@ class Simulator():
             
         bigmats = []
         for i, slot in enumerate(gates):
-            bigmat = Sparse.SparseMatrix(1, [Sparse.MatrixElement(0,0,1)])
-            for j in slot:
-                if type(j)==tuple:
-                    bigmat = self.__addLargeGate(j).tensorProduct(bigmat)
-                elif j == 's': continue
-                else: 
-                    bigmat = Sparse.makeSparse(self.singlegates[j]).tensorProduct(bigmat)
-            bigmats.append(bigmat)
+            bigmats.append(self.__makeSlot(slot))
             
         return np.array(bigmats)
         
-    def __Rt(self, theta):
-        """
-        Creates an r gate with the given phase
-    
-        :param theta: (float) The angle in radians which the qubit should be rotated by.
-        :return: (SparseMatrix) Matrix representation of the r gate.
-        """
-        return Sparse.makeSparse(np.array([[1, 0], [0, np.exp(1j*theta)]], dtype=complex))
-    
     def simulate(self, return_full = False):
         """
         Applies the circuit to the initialized statevector
@@ -272,9 +141,9 @@ class Simulator():
         """
         operations = self.makeMatrices()
         for i, operation in enumerate(operations):
-            self.register.Statevec = operation.apply(self.register.Statevec)
+            operation.apply(self.register.Statevec, out=self.register.Statevec)
             if i in self.measurements[0]:
-                self.measurements[1].append(self.register.Statevec.Elements)
+                self.measurements[1].append(self.register.Statevec.Elements.copy())
             
         if return_full: return self.register, operations, self.measurements
         return self.register
@@ -288,15 +157,9 @@ class Simulator():
         gates = np.array(self.gates, dtype = object).T
         
         for i, slot in enumerate(gates):
-            bigmat = Sparse.SparseMatrix(1, [Sparse.MatrixElement(0,0,1)])
-            for j in slot:
-                if type(j)==tuple:
-                    bigmat = self.__addLargeGate(j).tensorProduct(bigmat)
-                elif j == 's': continue
-                else: 
-                    bigmat = Sparse.makeSparse(self.singlegates[j]).tensorProduct(bigmat)
-            self.register.Statevec = bigmat.apply(self.register.Statevec)
+            bigmat = self.__makeSlot(slot)
+            bigmat.apply(self.register.Statevec, out=self.register.Statevec)
             if i in self.measurements[0]:
-                self.measurements[1].append(self.register.Statevec.Elements)
+                self.measurements[1].append(self.register.Statevec.Elements.copy())
         
         return self.register, self.measurements
\ No newline at end of file
@@ -3,6 +3,8 @@ This module includes all of the implementation for creating Sparse and Lazy Matr
 """
 
 from MatrixInterface import MatrixElement, Matrix, Vector, SquareMatrix
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import numpy as np
 
 
@@ -13,27 +15,12 @@ def makeSparse(matrix):
     :param matrix: (list) Matrix to be converted to Sparse
     :return: (list) Sparse matrix
     """
-    n = matrix[0].size
-    elements = []
-    for i in range(n):
-        for j in range(n):
-            if matrix[i][j] != 0 :
-                temp = MatrixElement(i, j, matrix[i][j])
-                elements.append(temp)
-    return SparseMatrix(n, elements)
+    return SparseMatrix.from_dense(matrix)
     
-class ColumnElement():
-    """
-    Column element ina sparse matrix
-    """
-    def __init__(self, j, val):
-        self.Row = j
-        self.Val = complex(val)
-    
-
 class SparseMatrix(Matrix, object):
     """
-    Creates sparse matrix, assumes they are square matrices 
+    Creates sparse matrix, assumes they are square matrices. The nonzero elements are stored
+    in coordinate form as three contiguous arrays (Rows, Cols, Vals), sorted by row and then column.
     
     :param n: (int) dimensions of matrix
     :param elements: (list) objects the requisite elements of the matrix
@@ -43,39 +30,157 @@ class SparseMatrix(Matrix, object):
     def __init__(self, n, elements):
         super().__init__(n, elements)
 
+    @classmethod
+    def from_coo(cls, n, rows, cols, vals, canonical=False):
+        """
+        Creates a sparse matrix directly from arrays of row indices, column indices and values
+
+        :param n: (int) dimensions of matrix
+        :param rows: (array) row index of each element
+        :param cols: (array) column index of each element
+        :param vals: (array) value of each element
+        :param canonical: (Boolean) True if the elements are already sorted by row and column with no repeats
+        :return: (SparseMatrix) The new matrix
+        """
+        matrix = cls.__new__(cls)
+        matrix.Dimension = n
+        matrix.setArrays(rows, cols, vals, canonical)
+        return matrix
+
+    @classmethod
+    def from_dense(cls, matrix):
+        """
+        Creates a sparse matrix from the nonzero elements of a dense matrix
+
+        :param matrix: (numpy.ndarray) Square matrix to be converted
+        :return: (SparseMatrix) The new matrix
+        """
+        matrix = np.asarray(matrix, dtype=complex)
+        rows, cols = np.nonzero(matrix)
+        return cls.from_coo(matrix.shape[0], rows, cols, matrix[rows, cols], canonical=True)
+
+    @classmethod
+    def from_diagonal(cls, diagonal):
+        """
+        Creates a diagonal sparse matrix
+
+        :param diagonal: (array) The elements on the diagonal of the matrix
+        :return: (SparseMatrix) The new matrix
+        """
+        diagonal = np.asarray(diagonal, dtype=complex)
+        index = np.arange(diagonal.size)
+        return cls.from_coo(diagonal.size, index, index, diagonal, canonical=True)
+
+    def setArrays(self, rows, cols, vals, canonical=False):
+        """
+        Replaces the elements of the matrix. Unless canonical, the elements are sorted 
+        by row and column and repeated positions are summed.
+
+        :param rows: (array) row index of each element
+        :param cols: (array) column index of each element
+        :param vals: (array) value of each element
+        :param canonical: (Boolean) True if the elements are already sorted with no repeats
+        """
+        rows = np.asarray(rows, dtype=np.int64).ravel()
+        cols = np.asarray(cols, dtype=np.int64).ravel()
+        vals = np.asarray(vals, dtype=complex).ravel()
+        if not canonical and rows.size > 0:
+            keys = rows * self.Dimension + cols
+            order = np.argsort(keys, kind='stable')
+            keys = keys[order]
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            rows, cols = rows[order][starts], cols[order][starts]
+            vals = np.add.reduceat(vals[order], starts)
+        self.Rows, self.Cols, self.Vals = rows, cols, vals
+        # start of each run of elements sharing a row, found when the matrix is first applied
+        self.RowStarts = None
+
+    @property
+    def Elements(self):
+        return list(self)
+
+    @Elements.setter
+    def Elements(self, elements):
+        self.setArrays([me.i for me in elements], [me.j for me in elements], [me.val for me in elements])
+
+    def __iter__(self):
+        for i, j, val in zip(self.Rows, self.Cols, self.Vals):
+            yield MatrixElement(int(i), int(j), val)
+
     def multiply(self, b):
         """
         Multiplies matrix with some other matrix b, will make this apply to none sparse matrices
-        can be called by A*b where A is a sparse matrix
+        can be called by A*b where A is a sparse matrix. Every element (i, k) of self is paired with 
+        the row k of b, and the products landing on the same (i, j) are accumulated into one element.
 
-        :param b: SparseMatrix()
-        :return: (list) the product of two matrices
+        :param b: SparseMatrix(), or a KronMatrix, ColMatrix or lazy operator which is expanded into one
+        :return: (SparseMatrix) the product of two matrices
         """
         assert(self.Dimension == b.Dimension)
-        p = []
-        for meb in b.Elements:
-            for mea in self.Elements:
-                if mea.j == meb.i:
-                    temp = mea.val * meb.val
-                    temp = MatrixElement(mea.i, meb.j, temp)
-                    p.append(temp)
-        p = SparseMatrix(len(p), p)
-        #print(p)
-        return p
+        if type(b) != SparseMatrix: b = b.toSparse()
+        indptr = b.rowPointers()
+        counts = indptr[self.Cols + 1] - indptr[self.Cols]
+        total = counts.sum()
+        # position in b of every term of the product
+        first = indptr[self.Cols] - (np.cumsum(counts) - counts)
+        positions = np.repeat(first, counts) + np.arange(total)
+        rows = np.repeat(self.Rows, counts)
+        vals = np.repeat(self.Vals, counts) * b.Vals[positions]
+        return SparseMatrix.from_coo(self.Dimension, rows, b.Cols[positions], vals)
+    
+    def rowPointers(self):
+        """
+        Finds where the elements of each row start, as in compressed sparse row form
+
+        :return: (numpy.ndarray) Array of size Dimension+1, the elements of row i are at [indptr[i], indptr[i+1])
+        """
+        return np.searchsorted(self.Rows, np.arange(self.Dimension + 1))
     
-    def apply(self, v):
+    def apply(self, v, out=None):
         """
-        Applies the sparse Matrix to some vector V
+        Applies the sparse Matrix to some vector V. Each row of the result is the sum of 
+        one contiguous run of the row sorted elements, so this takes O(nnz) time.
 
         :param v: some vector of the Vector() class
+        :param out: (Vector) optional vector the result is written into, may be v itself
         :return: (list) The resultant vector from applying the matrix to v
         """
-        u = np.zeros(self.Dimension, dtype=complex)
-        for me in self.Elements:
-            for index in range(v.Elements.size):
-                if index == me.j:
-                    u[me.i] += me.val * v.Elements[index]
-        u = Vector(u)    
+        x = v.Elements if type(v) == Vector else np.asarray(v)
+        assert x.size == self.Dimension, f'Incompatible dimensions: {self.Dimension}, {x.size}'
+        if out is None: return Vector(self.dot(x))
+        promote(out, np.result_type(x, np.complex64))
+        writeProduct(out, x.shape, np.result_type(x, np.complex64), lambda w: self.dot(x, out=w))
+        return out
+
+    def dot(self, x, out=None):
+        """
+        Multiplies the matrix with a dense array
+
+        :param x: (numpy.ndarray) Vector, or 2D array whose columns are multiplied
+        :param out: (numpy.ndarray) optional array the product is written into, which must not be x
+        :return: (numpy.ndarray) The product, with the same shape as x
+        """
+        if out is None: u = np.zeros(x.shape, dtype=np.result_type(x, np.complex64))
+        else:
+            u = out
+            u.fill(0)
+        if self.Rows.size == 0: return u
+        if self.RowStarts is None:
+            self.RowStarts = np.flatnonzero(np.r_[True, self.Rows[1:] != self.Rows[:-1]])
+        # the products and sums are made in scratch buffers of the thread, which are kept between calls
+        shape = (self.Cols.size,) + x.shape[1:]
+        products = scratchBuffer(int(np.prod(shape)), u.dtype, 'products').reshape(shape)
+        if x.dtype == u.dtype: np.take(x, self.Cols, axis=0, out=products, mode='clip')
+        else:
+            gathered = scratchBuffer(products.size, x.dtype, 'gathered').reshape(shape)
+            np.take(x, self.Cols, axis=0, out=gathered, mode='clip')
+            products[...] = gathered
+        np.multiply(products, self.Vals.reshape((-1,) + (1,)*(x.ndim-1)), out=products)
+        if self.RowStarts.size == self.Dimension: np.add.reduceat(products, self.RowStarts, axis=0, out=u)
+        else:
+            sums = scratchBuffer(self.RowStarts.size*products[0].size, u.dtype, 'sums').reshape((self.RowStarts.size,) + x.shape[1:])
+            np.add.reduceat(products, self.RowStarts, axis=0, out=sums)
+            u[self.Rows[self.RowStarts]] = sums
         return u
 
     def makedense(self):
@@ -83,30 +188,57 @@ class SparseMatrix(Matrix, object):
         makes a dense matrix
         """
         M = np.zeros((self.Dimension, self.Dimension), dtype= complex)
-        for me in self.Elements:
-            M[me.i][me.j] = me.val
+        M[self.Rows, self.Cols] = self.Vals
         return M
 
+    def isIdentity(self):
+        """
+        Checks whether the matrix is the identity
+
+        :return: (Boolean) True if the matrix is the identity
+        """
+        index = np.arange(self.Dimension)
+        return (self.Rows.size == self.Dimension and (self.Rows == index).all() 
+                and (self.Cols == index).all() and (self.Vals == 1).all())
 
     def tensorProduct(self, a):
         """
         Returns the tensor product of two matrices, 
-        currently applies to two sparse matrices
+        currently applies to two sparse matrices. If either of them is the identity 
+        the product is kept as a KronMatrix rather than being expanded.
 
         :param a: (list) sparse matrix to operate on
         :return: (list) result of tensor product
 
         """
-        assert (type(a) == SparseMatrix), 'Incompatible Matrices'
-        elements = []
-        dimension = self.Dimension * a.Dimension
-        for me1 in self.Elements:
-            for mea in a.Elements:
-                row = me1.i*a.Dimension + mea.i
-                col = me1.j*a.Dimension + mea.j
-                value = complex(me1.val * mea.val)
-                elements.append(MatrixElement(int(row), int(col), complex(value)))
-        return SparseMatrix(dimension, elements)
+        assert (type(a) in (SparseMatrix, KronMatrix)), 'Incompatible Matrices'
+        if type(a) == KronMatrix or self.isIdentity() or a.isIdentity():
+            return KronMatrix.wrap(self).tensorProduct(a)
+        return self.kron(a)
+
+    def kron(self, a):
+        """
+        Expands the tensor product of two sparse matrices. The element (p, q) of the product, 
+        made from element p of self and q of a, is written straight to its row sorted position,
+        so the cost is proportional to the number of elements in the product.
+
+        :param a: (SparseMatrix) matrix on the right hand side of the product
+        :return: (SparseMatrix) result of tensor product
+        """
+        indptrSelf, indptrA = self.rowPointers(), a.rowPointers()
+        lengthsSelf, lengthsA = np.diff(indptrSelf), np.diff(indptrA)
+        indptr = np.r_[0, np.cumsum(np.outer(lengthsSelf, lengthsA).ravel())]
+        rankSelf = np.arange(self.Rows.size) - indptrSelf[self.Rows]
+        rankA = np.arange(a.Rows.size) - indptrA[a.Rows]
+        rows = (self.Rows[:, None] * a.Dimension + a.Rows[None, :]).ravel()
+        positions = (indptr[rows] + (rankSelf[:, None] * lengthsA[a.Rows][None, :] + rankA[None, :]).ravel())
+        sortedRows = np.empty_like(rows)
+        sortedCols = np.empty_like(rows)
+        sortedVals = np.empty(rows.size, dtype=complex)
+        sortedRows[positions] = rows
+        sortedCols[positions] = (self.Cols[:, None] * a.Dimension + a.Cols[None, :]).ravel()
+        sortedVals[positions] = np.outer(self.Vals, a.Vals).ravel()
+        return SparseMatrix.from_coo(self.Dimension * a.Dimension, sortedRows, sortedCols, sortedVals, canonical=True)
 
     def __str__(self):
         temp = ''
@@ -114,9 +246,116 @@ class SparseMatrix(Matrix, object):
             temp += f'{element}\n'
         return temp
 
+
+def identity(n):
+    """
+    Creates the sparse identity matrix
+
+    :param n: (int) dimension of the matrix
+    :return: (SparseMatrix) The identity
+    """
+    return SparseMatrix.from_diagonal(np.ones(n))
+
+
+class KronMatrix(Matrix, object):
+    """
+    Represents the tensor product I_Left x SM x I_Right without expanding the identities, 
+    so the elements of SM are never duplicated. An identity core is kept as the 1x1 identity.
+
+    :param left: (int) dimension of the identity on the left
+    :param sm: (SparseMatrix) matrix in the middle of the product
+    :param right: (int) dimension of the identity on the right
+    """
+
+    def __init__(self, left, sm, right):
+        self.Left = left
+        self.SM = sm
+        self.Right = right
+        self.Dimension = left * sm.Dimension * right
+
+    @classmethod
+    def wrap(cls, m):
+        """
+        Represents a matrix as a KronMatrix
+
+        :param m: (SparseMatrix or KronMatrix) the matrix to represent
+        :return: (KronMatrix) the same matrix
+        """
+        if type(m) == KronMatrix: return m
+        if m.isIdentity(): return cls(m.Dimension, identity(1), 1)
+        return cls(1, m, 1)
+
+    def isIdentity(self):
+        return self.SM.Dimension == 1 and self.SM.isIdentity()
+
+    def tensorProduct(self, a):
+        """
+        Returns the tensor product with another matrix, only expanding identities that 
+        end up between two non identity matrices.
+
+        :param a: (SparseMatrix or KronMatrix) matrix on the right hand side of the product
+        :return: (KronMatrix) result of tensor product
+        """
+        a = KronMatrix.wrap(a)
+        if a.isIdentity():
+            return KronMatrix(self.Left, self.SM, self.Right * a.Dimension)
+        if self.isIdentity():
+            return KronMatrix(self.Dimension * a.Left, a.SM, a.Right)
+        core = self.SM.kron(identity(self.Right * a.Left)).kron(a.SM)
+        return KronMatrix(self.Left, core, a.Right)
+
+    def toSparse(self):
+        """
+        Expands the product into a SparseMatrix
+
+        :return: (SparseMatrix) the expanded matrix
+        """
+        return identity(self.Left).kron(self.SM).kron(identity(self.Right))
+
+    @property
+    def Elements(self):
+        return self.toSparse().Elements
+
+    def __iter__(self):
+        return iter(self.toSparse())
+
+    def multiply(self, b):
+        return self.toSparse().multiply(b)
+
+    def makedense(self):
+        return self.toSparse().makedense()
+
+    def apply(self, v, out=None):
+        """
+        Applies the matrix to some vector V, by applying SM along the middle axis of V 
+        viewed as a (Left, SM.Dimension, Right) array
+
+        :param v: some vector of the Vector() class
+        :param out: (Vector) optional vector the result is written into, may be v itself
+        :return: (Vector) The resultant vector from applying the matrix to v
+        """
+        x = v.Elements if type(v) == Vector else np.asarray(v)
+        assert x.size == self.Dimension, f'Incompatible dimensions: {self.Dimension}, {x.size}'
+        shape = (self.Left, self.SM.Dimension, self.Right)
+        # SM is applied to the strided (SM.Dimension, Left, Right) view, writing straight into the result
+        def product(w):
+            self.SM.dot(x.reshape(shape).transpose(1, 0, 2), out=w.reshape(shape).transpose(1, 0, 2))
+        if out is None:
+            out = Vector.empty(x.size, np.result_type(x, np.complex64))
+            product(out.Elements)
+            return out
+        promote(out, np.result_type(x, np.complex64))
+        writeProduct(out, x.shape, np.result_type(x, np.complex64), product)
+        return out
+
+    def __str__(self):
+        return self.toSparse().__str__()
+
 class ColMatrix(SquareMatrix):
     """
-    A type of sparse matrix extending the Square Matrix class
+    A type of sparse matrix extending the Square Matrix class, stored in compressed sparse column form.
+    The rows of column c are Indices[Indptr[c]:Indptr[c+1]] in increasing order, with values in Data.
+    Single elements that are set are kept in a staging dictionary until the matrix is next read as a whole.
     """
     def __init__(self, dims):
         """
@@ -124,73 +363,138 @@ class ColMatrix(SquareMatrix):
         :param dims: (int) dimension of the matrix
         """
         super().__init__(dims)
-        self.Columns = [[] for i in range(dims)]
+        self.Indptr = np.zeros(dims+1, dtype=np.int64)
+        self.Indices = np.zeros(0, dtype=np.int64)
+        self.Data = np.zeros(0, dtype=complex)
+        self.Staged = {}
+    
+    @classmethod
+    def from_coo(cls, dims, rows, cols, vals):
+        """
+        Creates a column matrix from arrays of row indices, column indices and values.
+        Values given for the same position are summed.
+
+        :param dims: (int) dimension of the matrix
+        :param rows: (array) row index of each element
+        :param cols: (array) column index of each element
+        :param vals: (array) value of each element
+        :return: (ColMatrix) The new matrix
+        """
+        # sorting by column then row is the row sorted form of the transpose
+        transpose = SparseMatrix.from_coo(dims, cols, rows, vals)
+        matrix = cls(dims)
+        matrix.Indptr = transpose.rowPointers()
+        matrix.Indices = transpose.Cols
+        matrix.Data = transpose.Vals
+        return matrix
+    
+    @classmethod
+    def from_dense(cls, mat):
+        """
+        Creates a column matrix from the nonzero elements of a dense array
+
+        :param mat: (numpy.ndarray) Square array to be converted
+        :return: (ColMatrix) The new matrix
+        """
+        mat = np.asarray(mat, dtype=complex)
+        cols, rows = np.nonzero(mat.T)
+        return cls.from_coo(mat.shape[0], rows, cols, mat[rows, cols])
+    
+    @classmethod
+    def from_diagonal(cls, diagonal):
+        """
+        Creates a diagonal column matrix
+
+        :param diagonal: (array) The elements on the diagonal of the matrix
+        :return: (ColMatrix) The new matrix
+        """
+        diagonal = np.asarray(diagonal, dtype=complex)
+        matrix = cls(diagonal.size)
+        matrix.Indptr = np.arange(diagonal.size+1, dtype=np.int64)
+        matrix.Indices = np.arange(diagonal.size, dtype=np.int64)
+        matrix.Data = diagonal.copy()
+        return matrix
     
     def __setitem__(self, pos, val):
         """
-        Sets a specific item in the matrix
+        Sets a specific item in the matrix. The item is staged and only merged into the arrays
+        once the whole matrix is needed.
 
         :param pos: (tuple) Position of the item to be set
         :param val: (complex) Value to set the item to
         """
         row, col = pos
-        if len(self.Columns[col])==0:
-            self.Columns[col].append(ColumnElement(row, val))
-        
-        elif self.Columns[col][-1].Row < row:
-            self.Columns[col].append(ColumnElement(row, val))
-        
-        else:
-            for index, element in enumerate(self.Columns[col]):
-                if element.Row == row:
-                    self.Columns[col][index] = ColumnElement(row, val)
-                    break
-                elif element.Row >= row:
-                    self.Columns.insert(index-1, ColumnElement(row, val))
-                    break
+        self.Staged[(int(row), int(col))] = complex(val)
                 
     def __getitem__(self, pos):
         """
-        Gets a specific item from the matrix
+        Gets a specific item from the matrix, using a binary search through the column
 
         :param pos: (tuple) Position of the item to acquire
         :return: (complex) number at that position in the matrix
         """
         row, col = pos
-        if len(self.Columns[col])==0:
-            return complex(0)
-        for element in self.Columns[col]:
-            if element.Row == row: return element.Val
-            if element.Row >= row: return complex(0)
+        if (row, col) in self.Staged: return self.Staged[(row, col)]
+        start, end = self.Indptr[col], self.Indptr[col+1]
+        index = start + np.searchsorted(self.Indices[start:end], row)
+        if index < end and self.Indices[index] == row: return complex(self.Data[index])
         return complex(0)
+    
+    def compact(self):
+        """
+        Merges the staged elements into the compressed arrays, replacing any existing values at those positions
+        """
+        if not self.Staged: return
+        staged = np.array(list(self.Staged.keys()), dtype=np.int64)
+        vals = np.array(list(self.Staged.values()), dtype=complex)
+        cols = self.columnIndices()
+        keep = ~np.isin(cols * self.Dimension + self.Indices, staged[:,1] * self.Dimension + staged[:,0])
+        self.Staged = {}
+        merged = ColMatrix.from_coo(self.Dimension, np.r_[self.Indices[keep], staged[:,0]], 
+                                    np.r_[cols[keep], staged[:,1]], np.r_[self.Data[keep], vals])
+        self.Indptr, self.Indices, self.Data = merged.Indptr, merged.Indices, merged.Data
+    
+    def columnIndices(self):
+        """
+        Expands Indptr into the column index of every stored element
+
+        :return: (numpy.ndarray) Column of each element of Indices and Data
+        """
+        return np.repeat(np.arange(self.Dimension, dtype=np.int64), np.diff(self.Indptr))
         
     def __str__(self):
         toPrint = ''
-        for c, column in enumerate(self.Columns):
-            for element in column:
-                
-                toPrint += f'{element.Row}, {c}, {element.Val} \n'
+        for element in self:
+            toPrint += f'{element.i}, {element.j}, {element.val} \n'
         return toPrint
         
     def __iter__(self):
-        for col, column in enumerate(self.Columns):
-            for element in column:
-                yield MatrixElement(element.Row, col, element.Val)
+        self.compact()
+        for row, col, val in zip(self.Indices, self.columnIndices(), self.Data):
+            yield MatrixElement(int(row), int(col), val)
     
     def tensorProduct(self, otherMatrix):
         """
-        Calculates the tensor product of two Column Matrices.
+        Calculates the tensor product of two Column Matrices. The compressed columns of a matrix
+        are the compressed rows of its transpose, and the transpose of a tensor product is the
+        tensor product of the transposes.
         
         :param otherMatrix: (ColMatrix) the matrix on the right hand side of the tensor product
         :return newMatrix: (ColMatrix) new matrix representing the tensor product
         """
-        newMatrix = ColMatrix(self.Dimension*otherMatrix.Dimension)
-        for col1, column in enumerate(self.Columns):
-            for element in column:
-                for col2, othercolumn in enumerate(otherMatrix.Columns):
-                    for otherElement in othercolumn:
-                        newMatrix[element.Row*otherMatrix.Dimension+otherElement.Row, col1*otherMatrix.Dimension + col2] = element.Val*otherElement.Val
+        transpose = self.transposeSparse().kron(otherMatrix.transposeSparse())
+        newMatrix = ColMatrix(transpose.Dimension)
+        newMatrix.Indptr, newMatrix.Indices, newMatrix.Data = transpose.rowPointers(), transpose.Cols, transpose.Vals
         return newMatrix
+    
+    def transposeSparse(self):
+        """
+        Creates the SparseMatrix of the transpose, which shares its arrays with self
+
+        :return: (SparseMatrix) Transpose of the matrix
+        """
+        self.compact()
+        return SparseMatrix.from_coo(self.Dimension, self.columnIndices(), self.Indices, self.Data, canonical=True)
         
     def toDense(self):
         """
@@ -198,12 +502,20 @@ class ColMatrix(SquareMatrix):
 
         :return dense: (numpy.ndarray) Numpy array representing the matrix
         """
+        self.compact()
         dense = np.zeros((self.Dimension, self.Dimension), dtype=complex)
-        for col, column in enumerate(self.Columns):
-            for element in column:
-                dense[element.Row, col] = element.Val
+        dense[self.Indices, self.columnIndices()] = self.Data
         return dense
     
+    def toSparse(self):
+        """
+        Creates the row sorted SparseMatrix representation of the matrix
+
+        :return: (SparseMatrix) SparseMatrix with the same elements
+        """
+        self.compact()
+        return SparseMatrix.from_coo(self.Dimension, self.Indices, self.columnIndices(), self.Data)
+    
     def multiply(self, m):
         """
         Multiplies self with another matrix
@@ -211,17 +523,24 @@ class ColMatrix(SquareMatrix):
         :param m: (ColMatrix) other matriix on the right hand side of the multiplication
         :return: (ColMatrix) Product of the multiplication
         """
-        p = ColMatrix(self.Dimension)
-        for me in m:
-            column = self.Columns[me.Row]
-            for ce in column:
-                p[ce.Row, me.Col] += ce.Val*me.Val
-        return p
+        p = self.toSparse() * m.toSparse()
+        return ColMatrix.from_coo(self.Dimension, p.Rows, p.Cols, p.Vals)
     
 class LazyMatrix(SquareMatrix):
     """
-    Creates a lazy matrix
+    Creates a lazy matrix. The class attributes tune how every lazy gate is applied, and can be 
+    changed on LazyMatrix for all gates or on one gate:
+
+    ChunkQubits: (int) a statevector kept in a numpy.memmap is read and written in chunks of 2**ChunkQubits amplitudes
+    Workers: (int) number of threads sharing the blocks of a large statevector between them
+    ParallelQubits: (int) the fewest qubits of a statevector whose blocks are shared between Workers threads
+    RealTolerance: (float) largest imaginary part of an entry of a gate taken to be real, such as that of exp(i pi)
     """
+    ChunkQubits = 20
+    Workers = 1
+    ParallelQubits = 16
+    RealTolerance = 1e-12
+
     def __init__(self, dims):
         """
         Initialiser
@@ -230,19 +549,46 @@ class LazyMatrix(SquareMatrix):
         """
         super().__init__(dims)
         self.Cache = None
+
+    def inBlocks(self, v, out):
+        """
+        Decides whether the gate is applied with blockApply, which it is when the result is kept in a
+        numpy.memmap, or when a statevector of at least ParallelQubits qubits is shared between Workers threads
+
+        :param v: (array or Vector) The vector the gate will be applied to
+        :param out: (Vector) The vector the result is written into, or None
+        :return: (bool) Whether to apply the gate a block at a time
+        """
+        if out is not None and isinstance(out.Elements, np.memmap): return True
+        if type(v) == Vector: v = v.Elements
+        return self.Workers > 1 and np.ndim(v) == 1 and self.Dimension >= 2**self.ParallelQubits
         
     def multiply(self, m):
         """
-        This operation is useless in our case and doesn't actually work, so ... yeah
+        Multiplies self with another matrix, by expanding both into SparseMatrix
 
-        :param m: (LazyMatrix) matrix to multiply by (perhaps implemented in the future)
-        :return:
+        :param m: (SparseMatrix, KronMatrix or LazyMatrix) matrix on the right hand side of the multiplication
+        :return: (SparseMatrix) Product of the multiplication
         """
         assert self.Dimension == m.Dimension, 'Incompatible dimensions'
-        pass
+        return self.toSparse().multiply(m)
+
+    def toSparse(self):
+        """
+        Expands the lazy matrix into a SparseMatrix by evaluating it a column at a time. The gates and 
+        products of gates expand themselves much faster.
+
+        :return: (SparseMatrix) The expanded matrix
+        """
+        if self.Cache is None:
+            self.Evaluate()
+        return self.Cache.toSparse()
+
+    def __iter__(self):
+        return iter(self.toSparse())
     
     def __getitem__(self, pos):
-        if len(self.Cache)==0:
+        if self.Cache is None:
             self.Evaluate()
         return self.Cache[pos]
         
@@ -271,7 +617,11 @@ class LazyMatrix(SquareMatrix):
 class Gate(LazyMatrix):
     """
     Lazy representation of a quantum gate
+
+    BlockLimit: (int) largest dimension of I_B x SM used to apply a gate on the lowest qubits as one matrix product
     """
+    BlockLimit = 64
+
     def __init__(self, dims, sm, qbpos):
         """
         Initialises Gate
@@ -284,47 +634,687 @@ class Gate(LazyMatrix):
         self.SM = sm
         self.smDim = sm.Dimension
         self.qbpos = np.array(qbpos)
+        assert self.smDim == 2**self.qbpos.size, f'Gate of dimension {self.smDim} cannot act on {self.qbpos.size} qubits'
+        self.Matrix = None
+        self.Tensor = None
+        self.Real = None
     
-    def apply(self, v):
+    def apply(self, v, out=None):
         """
-        Applies the Gate to a vector
+        Applies the Gate to a vector. The vector is viewed as an n dimensional (2,...,2) array, 
+        with the first axis being the most significant qubit, and the small matrix is contracted
+        over the axes of the qubits it acts on. If the qubits are a sorted, unbroken range the
+        vector is instead viewed as (above, SM.Dimension, below) and multiplied without reordering.
+        A (batch, dimension) array of vectors is applied to all at once.
 
         :param v: (array or Vector) The vector the gate will be applied to, must be the same dimesion as self
+        :param out: (Vector) optional vector the result is written into, may be v itself. A real out is 
+            made complex if the result is complex.
+        :return w: (Vector) The result of the application of the gate, complex64 for a complex64 vector
+        """
+        if self.inBlocks(v, out): return blockApply(self, v, out)
+        if type(v) == Vector: v = v.Elements
+        v = np.asarray(v)
+        if np.issubdtype(v.dtype, np.floating) and out is not None and self.isReal(): psi = v
+        else: psi = np.asarray(v, dtype=np.result_type(v, np.complex64))
+        if out is not None: promote(out, psi.dtype)
+        # the result is written into the spare buffer of out, which then becomes its elements
+        spare = out is not None and out.Elements.shape == psi.shape and out.Elements.dtype == psi.dtype
+        if spare: w = out.spare()
+        else:
+            w = np.empty(psi.shape, dtype=psi.dtype)
+            Vector.Allocations += 1
+        lowest = self.qbpos.min()
+        if (self.qbpos == np.arange(lowest, lowest + self.qbpos.size)).all():
+            self.__applyRange(psi, 2**lowest, w)
+        else:
+            self.__applyAxes(psi, w)
+        if out is None: return Vector.wrap(w, shared=False)
+        if spare: out.commit()
+        else: out.Elements[:] = w
+        return out
+
+    def isReal(self):
+        """
+        :return: (bool) Whether the small matrix of the gate is real, so that it keeps a real vector real
+        """
+        if self.Real is None:
+            matrix = self.smallMatrix()
+            self.Real = not np.iscomplexobj(matrix) or not np.any(np.abs(matrix.imag) > self.RealTolerance)
+        return self.Real
+    
+    def smallMatrix(self):
+        """
+        :return: (numpy.ndarray) The dense matrix acting on the qubits of the gate
+        """
+        if self.Matrix is None:
+            self.Matrix = toDense(self.SM)
+        return self.Matrix
+
+    def relocate(self, dims, qbpos):
+        """
+        Creates the same gate acting on other qubits of a statevector of another dimension
+
+        :param dims: (int) dimensions of the new large gate
+        :param qbpos: (list) The new qubits of the gate
+        :return: (Gate) The gate
+        """
+        gate = Gate(dims, self.SM, qbpos)
+        gate.Matrix = self.smallMatrix()
+        return gate
+
+    def toSparse(self):
+        """
+        :return: (SparseMatrix) The gate expanded to act on the whole statevector
+        """
+        matrix = self.smallMatrix()
+        rows, cols = np.nonzero(matrix)
+        return expandEntries(self.Dimension, self.qbpos, rows, cols, matrix[rows, cols])
+    
+    def __applyRange(self, psi, below, w):
+        """
+        Applies the Gate when its qubits are a sorted range, with below amplitudes between consecutive
+        values of the lowest qubit.
+
+        :param psi: (numpy.ndarray) The vector the gate will be applied to
+        :param below: (int) 2 to the power of the lowest qubit
+        :param w: (numpy.ndarray) The array the result is written into, with the shape and dtype of psi
+        """
+        matrix = castTo(self.smallMatrix(), psi.dtype)
+        if self.smDim * below <= self.BlockLimit:
+            block = castTo(np.kron(matrix, np.eye(below)), psi.dtype)
+            np.dot(psi.reshape(-1, block.shape[0]), block.T, out=w.reshape(-1, block.shape[0]))
+        else: np.matmul(matrix, psi.reshape(-1, self.smDim, below), out=w.reshape(-1, self.smDim, below))
+    
+    def __applyAxes(self, psi, w):
+        """
+        Applies the Gate to any qubits by contracting over the axes of the (2,...,2) view of the vector
+
+        :param psi: (numpy.ndarray) The vector the gate will be applied to
+        :param w: (numpy.ndarray) The array the result is written into, with the shape and dtype of psi
+        """
+        n = int(np.log2(self.Dimension))
+        k = self.qbpos.size
+        batch = psi.shape[:-1]
+        if self.Tensor is None:
+            self.Tensor = self.smallMatrix().reshape((2,)*(2*k))
+        # axis of the state tensor holding bit k of the small matrix index, most significant first
+        axes = [len(batch) + n - 1 - q for q in self.qbpos[::-1]]
+        labels = list(range(len(batch) + n))
+        outputs = list(labels)
+        for j, axis in enumerate(axes): outputs[axis] = len(labels) + j
+        np.einsum(castTo(self.Tensor, psi.dtype), [len(labels) + j for j in range(k)] + axes,
+                  psi.reshape(batch + (2,)*n), labels, outputs, out=w.reshape(batch + (2,)*n))
+
+
+class DiagonalGate(LazyMatrix):
+    """
+    Lazy representation of a quantum gate with a diagonal matrix. Only the entries of the 
+    diagonal that are not 1 are stored, and each one multiplies the amplitudes whose target 
+    qubits match its index.
+
+    ViewLimit: (int) above this many entries the whole diagonal is broadcast over the statevector instead
+    """
+    ViewLimit = 16
+
+    def __init__(self, dims, qbpos, indices, phases):
+        """
+        Initialises DiagonalGate
+
+        :param dims: (int) dimensions of the large gate
+        :param qbpos: (list) The qubits which the gate is applied to
+        :param indices: (list) Indices of the diagonal entries of the small matrix which are not 1
+        :param phases: (list) The values of those entries
+        """
+        super().__init__(dims)
+        self.qbpos = np.array(qbpos)
+        self.Indices = np.array(indices, dtype=np.int64)
+        self.Phases = np.array(phases, dtype=complex)
+    
+    @classmethod
+    def from_diagonal(cls, dims, diagonal, qbpos):
+        """
+        Creates a DiagonalGate from the full diagonal of the small matrix
+
+        :param dims: (int) dimensions of the large gate
+        :param diagonal: (array) The diagonal of the matrix acting on the qubits
+        :param qbpos: (list) The qubits which the gate is applied to
+        :return: (DiagonalGate) The gate
+        """
+        diagonal = np.asarray(diagonal, dtype=complex)
+        indices = np.flatnonzero(diagonal != 1)
+        return cls(dims, qbpos, indices, diagonal[indices])
+    
+    @classmethod
+    def controlled(cls, dims, qbpos, phase):
+        """
+        Creates a gate applying a phase to the states where all of the given qubits are active,
+        like the cz, cp, ncz and ncp gates
+
+        :param dims: (int) dimensions of the large gate
+        :param qbpos: (list) The qubits which the gate is applied to
+        :param phase: (complex) The phase applied
+        :return: (DiagonalGate) The gate
+        """
+        return cls(dims, qbpos, [2**len(qbpos) - 1], [phase])
+    
+    def smallMatrix(self):
+        """
+        :return: (numpy.ndarray) The dense matrix acting on the qubits of the gate
+        """
+        diagonal = np.ones(2**self.qbpos.size, dtype=complex)
+        diagonal[self.Indices] = self.Phases
+        return np.diag(diagonal)
+
+    def relocate(self, dims, qbpos):
+        """
+        Creates the same gate acting on other qubits of a statevector of another dimension
+
+        :param dims: (int) dimensions of the new large gate
+        :param qbpos: (list) The new qubits of the gate
+        :return: (DiagonalGate) The gate
+        """
+        return DiagonalGate(dims, qbpos, self.Indices, self.Phases)
+
+    def toSparse(self):
+        """
+        :return: (SparseMatrix) The gate expanded to act on the whole statevector
+        """
+        assert self.Phases.ndim == 1, 'A gate with a phase for each vector of a batch cannot be expanded'
+        diagonal = np.ones(self.Dimension, dtype=complex)
+        rest = otherIndices(self.Dimension, self.qbpos)
+        for index, phase in zip(self.Indices, self.Phases):
+            diagonal[rest | spreadIndex(self.qbpos, index)] = phase
+        return SparseMatrix.from_diagonal(diagonal)
+
+    def isReal(self):
+        """
+        :return: (bool) Whether the phases of the gate are real, so that it keeps a real vector real
+        """
+        return not np.any(np.abs(self.Phases.imag) > self.RealTolerance)
+
+    def block(self, c, index):
+        """
+        Creates the part of the gate acting on one block of 2**c amplitudes of the statevector, which 
+        keeps the entries whose qubits from c upwards match the index of the block
+
+        :param c: (int) The number of qubits inside each block
+        :param index: (int) The index of the block, given by the qubits from c upwards
+        :return: (DiagonalGate) The gate acting on the block, or None if no entries are kept
+        """
+        qbpos = [int(q) for q in self.qbpos]
+        local = [k for k, q in enumerate(qbpos) if q < c]
+        match = np.ones(self.Indices.size, dtype=bool)
+        for k, q in enumerate(qbpos):
+            if q >= c: match &= ((self.Indices >> k) & 1) == ((index >> (q - c)) & 1)
+        if not match.any(): return None
+        indices = np.zeros(int(match.sum()), dtype=np.int64) # the index of each kept entry on the qubits below c
+        for j, k in enumerate(local):
+            indices += ((self.Indices[match] >> k) & 1) << j
+        return DiagonalGate(2**c, [qbpos[k] for k in local], indices, self.Phases[match])
+    
+    def apply(self, v, out=None):
+        """
+        Applies the Gate to a vector, by multiplying the amplitudes selected by the qubits of each entry.
+        A (batch, dimension) array of vectors is applied to all at once, and the phases may have a 
+        second axis giving a different phase for each vector of the batch.
+
+        :param v: (array or Vector) The vector the gate will be applied to, must be the same dimesion as self
+        :param out: (Vector) optional vector the result is written into, may be v itself. A real out is 
+            made complex if the phases are complex.
         :return w: (Vector) The result of the application of the gate
         """
-        w = Vector(np.zeros(self.Dimension))
-        for i in range(self.Dimension):
-            r = self.__gather(i)
-            i0 = i & ~self.__scatter(r)
-            for c in range(self.smDim):
-                j = i0 | self.__scatter(c)
-                w[i] += self.SM[r,c] * v[j]
-        return w
-        
-    def __gather(self, i):
+        if self.inBlocks(v, out): return blockApply(self, v, out)
+        if type(v) == Vector: v = v.Elements
+        if out is None: out = Vector(v)
+        elif out.Elements is not v:
+            promote(out, np.asarray(v).dtype)
+            out.Elements[:] = v
+        if not self.isReal(): promote(out, self.Phases.dtype)
+        n = int(np.log2(self.Dimension))
+        k = self.qbpos.size
+        psi = out.Elements.reshape(out.Elements.shape[:-1] + (2,)*n)
+        batch = self.Phases.shape[1:]
+        if self.Indices.size <= self.ViewLimit:
+            for index, phase in zip(self.Indices, self.Phases):
+                psi[qubitSelection(n, self.qbpos, index)] *= castTo(np.reshape(phase, batch + (1,)*(n-k)), psi.dtype)
+        else:
+            # axis of the state tensor holding bit k of the small matrix index, most significant first
+            axes = [len(batch) + n - 1 - q for q in self.qbpos[::-1]]
+            diagonal = np.ones(batch + (2**k,), dtype=psi.dtype)
+            diagonal[..., self.Indices] = castTo(np.moveaxis(self.Phases, 0, -1), psi.dtype)
+            diagonal = diagonal.reshape(batch + (2,)*k + (1,)*(n-k))
+            psi *= np.moveaxis(diagonal, list(range(len(batch), len(batch) + k)), axes)
+        return out
+
+
+class PermutationGate(LazyMatrix):
+    """
+    Lazy representation of a quantum gate which only permutes the amplitudes, like the x, cnot, 
+    ccnot and swap gates. The small matrix has M[perm[c], c] = 1, so the amplitudes whose target 
+    qubits match c are moved to perm[c]. Each cycle of the permutation is applied by moving 
+    strided views of the statevector, so the cost does not depend on where the qubits are.
+    """
+    def __init__(self, dims, qbpos, perm):
+        """
+        Initialises PermutationGate
+
+        :param dims: (int) dimensions of the large gate
+        :param qbpos: (list) The qubits which the gate is applied to
+        :param perm: (list) Where each index of the small matrix is sent
+        """
+        super().__init__(dims)
+        self.qbpos = np.array(qbpos)
+        self.Perm = np.array(perm, dtype=np.int64)
+        assert self.Perm.size == 2**self.qbpos.size, f'Permutation of size {self.Perm.size} cannot act on {self.qbpos.size} qubits'
+        self.Cycles = []
+        visited = self.Perm == np.arange(self.Perm.size)
+        for start in range(self.Perm.size):
+            if visited[start]: continue
+            cycle = [start]
+            visited[start] = True
+            while not visited[self.Perm[cycle[-1]]]:
+                cycle.append(self.Perm[cycle[-1]])
+                visited[cycle[-1]] = True
+            self.Cycles.append(cycle)
+    
+    @classmethod
+    def controlledNot(cls, dims, controls, target):
         """
-        Magic method 
+        Creates a not gate controlled by any number of qubits, which is the x gate with no controls
 
-        :param i: (int) The row number of the gate
-        :return j: (int)
+        :param dims: (int) dimensions of the large gate
+        :param controls: (list) The control qubits
+        :param target: (int) The qubit which is flipped
+        :return: (PermutationGate) The gate
         """
-        j = 0
-        for k in range(len(self.qbpos)):
-            j |= ((i >> self.qbpos[k]) & 1) << k
-        return j
+        perm = np.arange(2**(len(controls)+1))
+        # the target is bit 0 of the small matrix index, so flip it where all the controls are active
+        perm[-2:] = perm[-2:][::-1]
+        return cls(dims, [target] + list(controls), perm)
     
-    def __scatter(self, j):
+    @classmethod
+    def swap(cls, dims, qbit1, qbit2):
         """
-        Magic method 
+        Creates a gate swapping two qubits
 
-        :param i: (int)
-        :return j: (int)
+        :param dims: (int) dimensions of the large gate
+        :param qbit1: (int) qubit to be swapped
+        :param qbit2: (int) qubit to be swapped
+        :return: (PermutationGate) The gate
+        """
+        return cls(dims, [qbit1, qbit2], [0, 2, 1, 3])
+    
+    def smallMatrix(self):
+        """
+        :return: (numpy.ndarray) The dense matrix acting on the qubits of the gate
         """
-        i = 0
-        for k in range(len(self.qbpos)):
-            i |= ((j>>k)&1) << self.qbpos[k]
-        return i
+        matrix = np.zeros((self.Perm.size, self.Perm.size), dtype=complex)
+        matrix[self.Perm, np.arange(self.Perm.size)] = 1
+        return matrix
+
+    def relocate(self, dims, qbpos):
+        """
+        Creates the same gate acting on other qubits of a statevector of another dimension
+
+        :param dims: (int) dimensions of the new large gate
+        :param qbpos: (list) The new qubits of the gate
+        :return: (PermutationGate) The gate
+        """
+        return PermutationGate(dims, qbpos, self.Perm)
+
+    def toSparse(self):
+        """
+        :return: (SparseMatrix) The gate expanded to act on the whole statevector
+        """
+        return expandEntries(self.Dimension, self.qbpos, self.Perm, np.arange(self.Perm.size), np.ones(self.Perm.size))
+
+    def isReal(self):
+        """
+        :return: (bool) True, as moving amplitudes keeps a real vector real
+        """
+        return True
+    
+    def apply(self, v, out=None):
+        """
+        Applies the Gate to a vector, by moving the amplitudes along each cycle of the permutation
+
+        :param v: (array or Vector) The vector the gate will be applied to, must be the same dimesion as self
+        :param out: (Vector) optional vector the result is written into, may be v itself
+        :return w: (Vector) The result of the application of the gate
+        """
+        if self.inBlocks(v, out): return blockApply(self, v, out)
+        if type(v) == Vector: v = v.Elements
+        if out is None: out = Vector(v)
+        elif out.Elements is not v:
+            promote(out, np.asarray(v).dtype)
+            out.Elements[:] = v
+        n = int(np.log2(self.Dimension))
+        psi = out.Elements.reshape(out.Elements.shape[:-1] + (2,)*n)
+        # the amplitudes moved off the end of a cycle are kept in the same place of the spare buffer
+        spare = out.spare().reshape(psi.shape)
+        for cycle in self.Cycles:
+            views = [qubitSelection(n, self.qbpos, index) for index in cycle]
+            spare[views[-1]] = psi[views[-1]]
+            for i in range(len(views)-1, 0, -1):
+                psi[views[i]] = psi[views[i-1]]
+            psi[views[0]] = spare[views[-1]]
+        return out
+
+
+def qubitSelection(n, qbpos, index):
+    """
+    Creates the index into the (2,...,2) view of a statevector which selects the amplitudes 
+    whose target qubits match the index of a small matrix
 
+    :param n: (int) Number of qubits of the statevector
+    :param qbpos: (list) The target qubits, bit k of index gives the value of qbpos[k]
+    :param index: (int) Index of the small matrix
+    :return: (tuple) The selection, which also works with any axes before the n axes of the qubits
+    """
+    selection = [slice(None)]*n
+    for bit, q in enumerate(qbpos):
+        selection[n - 1 - q] = (index >> bit) & 1
+    return (Ellipsis,) + tuple(selection)
+
+
+def spreadIndex(qbpos, index):
+    """
+    :param qbpos: (list) Some qubits of a statevector
+    :param index: (int or numpy.ndarray) Index of a small matrix acting on them, bit k giving the value of qbpos[k]
+    :return: (int or numpy.ndarray) The index of the statevector with those qubits set as in index and the others 0
+    """
+    return sum(((index >> k) & 1) << int(q) for k, q in enumerate(qbpos))
+
+
+def otherIndices(dims, qbpos):
+    """
+    :param dims: (int) The dimension of the statevector
+    :param qbpos: (list) Some qubits of the statevector
+    :return: (numpy.ndarray) The indices of the statevector where all of those qubits are 0
+    """
+    indices = np.arange(dims)
+    return indices[(indices & spreadIndex(qbpos, 2**len(qbpos) - 1)) == 0]
+
+
+def expandEntries(dims, qbpos, rows, cols, vals):
+    """
+    Expands the entries of a small matrix acting on some qubits into a SparseMatrix acting on the whole 
+    statevector, repeating each entry for every value of the other qubits
+
+    :param dims: (int) The dimension of the statevector
+    :param qbpos: (list) The qubits of the small matrix
+    :param rows: (numpy.ndarray) Rows of the non zero entries of the small matrix
+    :param cols: (numpy.ndarray) Columns of the entries
+    :param vals: (numpy.ndarray) Values of the entries
+    :return: (SparseMatrix) The expanded matrix
+    """
+    rest = otherIndices(dims, qbpos)
+    rows = (spreadIndex(qbpos, np.asarray(rows))[:, None] | rest).reshape(-1)
+    cols = (spreadIndex(qbpos, np.asarray(cols))[:, None] | rest).reshape(-1)
+    return SparseMatrix.from_coo(dims, rows, cols, np.repeat(vals, rest.size))
+
+
+def writeProduct(out, shape, dtype, product):
+    """
+    Writes a product, which must not be written into the vector it is computed from, into a Vector. It is
+    written into the spare buffer of the vector, which then becomes its elements. When the vector has another
+    shape or dtype a new array is made and counted in Vector.Allocations.
+
+    :param out: (Vector) The vector written into
+    :param shape: (tuple) The shape of the product
+    :param dtype: (numpy.dtype) The dtype of the product
+    :param product: (function) Writes the product into the array it is called with
+    """
+    if out.Elements.shape == shape and out.Elements.dtype == dtype:
+        product(out.spare())
+        out.commit()
+        return
+    w = np.empty(shape, dtype=dtype)
+    Vector.Allocations += 1
+    product(w)
+    out.Elements[...] = w
+
+
+def castTo(values, dtype):
+    """
+    :param values: (numpy.ndarray) Matrix entries or phases
+    :param dtype: (numpy.dtype) The dtype of the statevector they are applied to
+    :return: (numpy.ndarray) The values with that dtype, keeping only their real parts for a real dtype
+    """
+    if not np.issubdtype(dtype, np.complexfloating): values = np.real(values)
+    return np.asarray(values).astype(dtype, copy=False)
+
+
+def promote(out, dtype):
+    """
+    Makes the elements of a real Vector complex, keeping their values, before values of dtype are written into it.
+    A real statevector is promoted this way when the first gate with a complex matrix is applied to it.
+
+    :param out: (Vector) The vector written into
+    :param dtype: (numpy.dtype) The dtype of the values written
+    """
+    if np.iscomplexobj(out.Elements) or not np.issubdtype(dtype, np.complexfloating): return
+    out.Elements = out.Elements.astype(np.result_type(out.Elements, np.complex64))
+    Vector.Allocations += 1
+
+
+# the thread pool shared by all gates and its number of threads
+executor = None
+executorWorkers = 0
+# scratch buffers of each thread for the blocks of blockApply, kept between gates
+scratch = threading.local()
+
+def workerPool(workers):
+    """
+    :param workers: (int) The number of threads
+    :return: (ThreadPoolExecutor) The thread pool shared by all gates, made again when the number of threads changes
+    """
+    global executor, executorWorkers
+    if executor is None or executorWorkers != workers:
+        if executor is not None: executor.shutdown()
+        executor = ThreadPoolExecutor(max_workers=workers)
+        executorWorkers = workers
+    return executor
+
+
+def scratchBuffer(size, dtype, use='block'):
+    """
+    Finds a buffer of the calling thread, made when first needed and again only when it is too small
+
+    :param size: (int) The number of elements needed
+    :param dtype: (numpy.dtype) The dtype of the elements
+    :param use: (str) What the buffer is for, so that buffers in use at the same time are different
+    :return: (numpy.ndarray) The first size elements of the buffer of that use and dtype
+    """
+    buffers = scratch.__dict__.setdefault('buffers', {})
+    key = (use, np.dtype(dtype))
+    if key not in buffers or buffers[key].size < size:
+        buffers[key] = np.empty(size, dtype=dtype)
+        Vector.Allocations += 1
+    return buffers[key][:size]
+
+
+def blockApply(gate, v, out):
+    """
+    Applies a lazy gate to a statevector one block of 2**c amplitudes at a time. The qubits below c are
+    inside every block and the higher qubits pick the block. A DiagonalGate is applied to each block 
+    on its own, keeping the entries whose higher qubits match the block. Other gates on higher qubits 
+    are applied to each group of blocks which only differ in those qubits, so the groups are independent. 
+
+    A statevector kept in a numpy.memmap uses blocks of 2**ChunkQubits amplitudes so that only a few 
+    are in memory at once. Otherwise the blocks are picked by the highest qubits the gate does not act on, 
+    making a few groups for each thread, and NumPy releases the GIL while it works on each group.
+    The groups are shared between Workers threads when Workers is more than one.
+    A group of blocks is gathered through a strided view of the statevector into the scratch buffer of 
+    the thread, which also gives the blocks their spare buffer, so no memory is allocated per block.
+
+    :param gate: (Gate, DiagonalGate or PermutationGate) The gate to apply
+    :param v: (array or Vector) The vector the gate will be applied to
+    :param out: (Vector) optional vector the result is written into, may be v itself
+    :return w: (Vector) The result of the application of the gate
+    """
+    if type(v) == Vector: v = v.Elements
+    if out is None: out = Vector(v)
+    promote(out, np.asarray(v).dtype)
+    if not gate.isReal(): promote(out, np.complex64)
+    psi = out.Elements
+    if v is not psi: psi[:] = v
+    n = int(np.log2(gate.Dimension))
+    qbpos = [int(q) for q in gate.qbpos]
+    if isinstance(psi, np.memmap): c = min(n, gate.ChunkQubits)
+    else:
+        split = min(n - len(set(qbpos)), int(np.ceil(np.log2(4*gate.Workers))))
+        free = [q for q in range(n-1, -1, -1) if q not in qbpos][:split]
+        c = min(free) if split > 0 else n
+    size = 2**c
+    if type(gate) == DiagonalGate:
+        def task(chunk):
+            part = gate.block(c, chunk)
+            if part is None: return
+            part.Workers = 1
+            block = Vector.wrap(np.asarray(psi[chunk*size:(chunk+1)*size]))
+            block.Spare = scratchBuffer(size, psi.dtype)
+            part.apply(block, out=block)
+        count = 2**(n - c)
+    else:
+        high = sorted(set(q for q in qbpos if q >= c))
+        # in a group the blocks are put one after another, so higher qubit high[k] becomes qubit c+k
+        place = {q: (q if q < c else c + high.index(q)) for q in qbpos}
+        part = gate.relocate(2**(c + len(high)), [place[q] for q in qbpos])
+        part.Workers = 1
+        others = [q for q in range(c, n) if q not in high]
+        # the blocks as a (2,...,2, size) array, with the axis of qubit q at n-1-q
+        blocks = psi.reshape((2,)*(n - c) + (size,))
+        def task(group):
+            if len(high) == 0:
+                first = sum(((group >> k) & 1) << (q - c) for k, q in enumerate(others))
+                block = Vector.wrap(np.asarray(psi[first*size:(first+1)*size]))
+                block.Spare = scratchBuffer(size, psi.dtype)
+                part.apply(block, out=block)
+                return
+            selection = [slice(None)]*(n - c)
+            for k, q in enumerate(others): selection[n - 1 - q] = (group >> k) & 1
+            view = blocks[tuple(selection)]
+            buffer = scratchBuffer(2*view.size, psi.dtype)
+            block = Vector.wrap(buffer[:view.size], shared=False)
+            block.Spare = buffer[view.size:]
+            block.Elements.reshape(view.shape)[...] = view
+            part.apply(block, out=block)
+            view[...] = block.Elements.reshape(view.shape)
+        count = 2**len(others)
+    if gate.Workers > 1 and count > 1: list(workerPool(gate.Workers).map(task, range(count)))
+    else:
+        for index in range(count): task(index)
+    return out
+
+
+class LazyProduct(LazyMatrix):
+    """
+    Lazy representation of a number of operators applied one after another
+    """
+    def __init__(self, dims, operators):
+        """
+        Initialises LazyProduct
+
+        :param dims: (int) dimensions of the operators
+        :param operators: (list) The operators, in the order they are applied
+        """
+        super().__init__(dims)
+        self.Operators = operators
+    
+    def apply(self, v, out=None):
+        """
+        Applies each of the operators to a vector in turn
+
+        :param v: (array or Vector) The vector the operators will be applied to
+        :param out: (Vector) optional vector the result is written into, may be v itself
+        :return w: (Vector) The result of the application of the operators
+        """
+        if type(v) == Vector: v = v.Elements
+        if out is None: out = Vector(v)
+        elif out.Elements is not v:
+            promote(out, np.asarray(v).dtype)
+            out.Elements[:] = v
+        for operator in self.Operators:
+            operator.apply(out, out=out)
+        return out
+
+    def toSparse(self):
+        """
+        Multiplies the operators together, the last one applied being on the left
+
+        :return: (SparseMatrix) The expanded product
+        """
+        product = None
+        for operator in self.Operators:
+            matrix = operator if type(operator) == SparseMatrix else operator.toSparse()
+            product = matrix if product is None else matrix.multiply(product)
+        return product
+
+
+def diagonalOf(mat):
+    """
+    Finds the diagonal of a matrix if it is diagonal, without making it dense
+
+    :param mat: (ColMatrix, SparseMatrix, KronMatrix or numpy.ndarray) Matrix to check
+    :return: (numpy.ndarray) The diagonal of mat, or None if mat is not diagonal
+    """
+    if isinstance(mat, KronMatrix): mat = mat.toSparse()
+    if isinstance(mat, ColMatrix): mat = mat.toSparse()
+    if isinstance(mat, SparseMatrix):
+        if (mat.Rows != mat.Cols).any(): return None
+        diagonal = np.zeros(mat.Dimension, dtype=complex)
+        diagonal[mat.Rows] = mat.Vals
+        return diagonal
+    mat = np.asarray(mat, dtype=complex)
+    diagonal = np.diag(mat)
+    if np.count_nonzero(mat) != np.count_nonzero(diagonal): return None
+    return diagonal.copy()
+
+def permutationOf(mat):
+    """
+    Finds the permutation of a matrix if it is a permutation matrix, without making it dense
+
+    :param mat: (ColMatrix, SparseMatrix, KronMatrix or numpy.ndarray) Matrix to check
+    :return: (numpy.ndarray) Array perm with mat[perm[c], c] = 1, or None if mat is not a permutation
+    """
+    if isinstance(mat, KronMatrix): mat = mat.toSparse()
+    if isinstance(mat, ColMatrix): mat = mat.toSparse()
+    if not isinstance(mat, SparseMatrix): mat = SparseMatrix.from_dense(mat)
+    if mat.Rows.size != mat.Dimension or (mat.Vals != 1).any(): return None
+    perm = np.full(mat.Dimension, -1, dtype=np.int64)
+    perm[mat.Cols] = mat.Rows
+    # the rows are already distinct, so every column appearing once makes a permutation
+    if (perm < 0).any(): return None
+    return perm
+
+def makeGate(dims, sm, qbpos):
+    """
+    Creates the lazy gate best suited to the matrix given
+
+    :param dims: (int) dimensions of the large gate
+    :param sm: (ColMatrix) The sparse matrix representing the quantum gate
+    :param qbpos: (list) The qubits which the gate is applied to
+    :return: (DiagonalGate, PermutationGate or Gate) The gate
+    """
+    diagonal = diagonalOf(sm)
+    if diagonal is not None: return DiagonalGate.from_diagonal(dims, diagonal, qbpos)
+    perm = permutationOf(sm)
+    if perm is not None: return PermutationGate(dims, qbpos, perm)
+    return Gate(dims, sm, qbpos)
+
+
+def toDense(mat):
+    """
+    Creates a dense numpy array from any of the matrix representations
+
+    :param mat: (ColMatrix, SparseMatrix, KronMatrix or numpy.ndarray) Matrix to be converted
+    :return: (numpy.ndarray) Dense representation of mat
+    """
+    if isinstance(mat, ColMatrix): return mat.toDense()
+    if isinstance(mat, (SparseMatrix, KronMatrix)): return mat.makedense()
+    return np.array(mat, dtype=complex)
 
 def toColMat(mat):
     """
@@ -333,13 +1323,7 @@ def toColMat(mat):
     :param mat: (numpy.ndarray) Array to be converted
     :return: (ColMatrix) Column matrix representation of mat
     """
-    mat = np.array(mat, dtype=complex)
-    toReturn = ColMatrix(mat[0].size)
-    for i in range(mat[0].size):
-        for j in range(mat[0].size):
-            
-            if mat[i,j] != 0: toReturn[i,j] = mat[i,j]
-    return toReturn
+    return ColMatrix.from_dense(mat)
 
 if __name__ == "__main__":
     pass
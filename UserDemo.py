@@ -9,6 +9,9 @@ import numpy as np
 import matplotlib.pyplot as plt
 import time
 import Sparse
+import QuantumRegister
+import os
+import tempfile
 
 def timeBenchmarks():
     """
@@ -139,11 +142,9 @@ def compareProbabilities():
         grover_circuit.addGate('h', [i for i in range(n_qubits)])
         grover_circuit.addmeasure()
         # calculate oracle
-        oracle = Sparse.ColMatrix(2**n_qubits)
-        for i in range(2**n_qubits):
-            if i in [measured_bits]:
-                oracle[i,i] = -1
-            else: oracle[i,i] = 1
+        diagonal = np.ones(2**n_qubits)
+        diagonal[measured_bits] = -1
+        oracle = Sparse.ColMatrix.from_diagonal(diagonal)
 
         #Add Oracle
         grover_circuit.addCustom(0, n_qubits-1, oracle, 'oracle')
@@ -174,6 +175,338 @@ def compareProbabilities():
     print(f"\nResult 2 :")
     print(np.array(numpy_max_measures, dtype=object))   
     
+def multiplyBenchmark():
+    """
+    Checks the runtime of multiplying consecutive slot operators of a circuit together, first by comparing
+    every pair of nonzero elements as the SparseMatrix multiplication used to, and second using the 
+    row accumulated SparseMatrix.multiply. Also checks that both give the same product.
+    """
+    
+    def pairwiseMultiply(a, b):
+        # the old method, compares every element of a with every element of b
+        elements = []
+        for meb in b:
+            for mea in a:
+                if mea.j == meb.i:
+                    elements.append(Sparse.MatrixElement(mea.i, meb.j, mea.val * meb.val))
+        return Sparse.SparseMatrix(a.Dimension, elements)
+    
+    qbits = np.arange(8,13,1)
+    times = np.zeros((2,len(qbits)))
+    
+    for k, q in enumerate(qbits):
+        circuit = QuantumCircuit('Benchmark', q)
+        circuit.addGate('x', [i for i in range(q)])
+        circuit.cnot(0, q-1)
+        circuit.ncz([i for i in range(q)])
+        circuit.swap(0, q-1)
+        operations = Simulator.Simulator(circuit.gates, circuit.register, circuit.customgates, []).makeMatrices()
+        
+        t1 = time.time()
+        for a, b in zip(operations[1:], operations[:-1]):
+            slow = pairwiseMultiply(a, b)
+        t2 = time.time()
+        times[0,k] = t2-t1
+        
+        t1 = time.time()
+        for a, b in zip(operations[1:], operations[:-1]):
+            fast = a * b
+        t2 = time.time()
+        times[1,k] = t2-t1
+        
+        print(f"{q} qubits: pairwise {times[0,k]:.4f}s, accumulated {times[1,k]:.4f}s, same product: {np.allclose(slow.makedense(), fast.makedense())}")
+        
+    plt.plot(qbits, times[0], label='Pairwise')
+    plt.plot(qbits, times[1], label='Row accumulated')
+    plt.title("Runtime of multiplying slot operators over Number of Qubits in the system")
+    plt.xlabel("Number of Qubits")
+    plt.ylabel("Runtime (s)")
+    plt.yscale("log")
+    plt.xticks(qbits)
+    plt.legend()
+    plt.show()
+    
+def compactionBenchmark():
+    """
+    Builds layers of single qubit gates added one qubit at a time, followed by cnots between 
+    distant qubits, and compares the depth and the runtime of simulate2 before and after the 
+    circuit is compacted. Also checks that both give the same statevector.
+    """
+    for q in range(6, 13, 2):
+        circuits = []
+        for compact in (False, True):
+            rng = np.random.default_rng(q)
+            circuit = QuantumCircuit('Compaction', q)
+            for layer in range(10):
+                for qbit in range(q):
+                    circuit.addGate(str(rng.choice(['h', 'x', 't'])), [qbit])
+                for qbit in range(q//2):
+                    circuit.cnot(qbit, qbit + q//2)
+            depths = circuit.compact() if compact else (circuit.gateindex + 1,)*2
+            t1 = time.time()
+            circuit.simulate2()
+            circuits.append((depths, time.time() - t1, circuit.register.Statevec.Elements))
+        same = np.allclose(circuits[0][2], circuits[1][2])
+        print(f"{q} qubits: depth {circuits[1][0][0]} -> {circuits[1][0][1]}, simulate2 {circuits[0][1]:.4f}s -> {circuits[1][1]:.4f}s, same state: {same}")
+    
+def batchBenchmark():
+    """
+    Sweeps the angle of a parameterised circuit, first binding each angle and running lazysim, 
+    then running all of the angles as one batch. Also checks that both give the same statevectors.
+    """
+    angles = np.linspace(0, 2*np.pi, 64)
+    for q in range(6, 15, 4):
+        theta = Parameter('theta')
+        circuit = QuantumCircuit('Batch', q)
+        circuit.addGate('h', [i for i in range(q)])
+        for layer in range(5):
+            circuit.r([i for i in range(q)], theta)
+            for i in range(q-1):
+                circuit.cnot(i, i+1)
+            circuit.addGate('h', [i for i in range(q)])
+        
+        t1 = time.time()
+        looped = []
+        for angle in angles:
+            circuit.bind({'theta': angle})
+            circuit.register.reset()
+            looped.append(circuit.lazysim()[0].Statevec.Elements.copy())
+        t2 = time.time()
+        circuit.register.reset()
+        batched, measurements = circuit.batchsim(params={'theta': angles})
+        t3 = time.time()
+        print(f"{q} qubits, {angles.size} angles: looped {t2-t1:.4f}s, batched {t3-t2:.4f}s, same states: {np.allclose(looped, batched)}")
+    
+def memmapBenchmark():
+    """
+    Runs the same circuit with lazysim on a register kept in memory and on a register kept in a 
+    numpy.memmap file, and compares the runtimes and the amplitudes processed per second.
+    Also checks that both give the same statevector.
+    """
+    for q in range(20, 25, 2):
+        states = []
+        with tempfile.TemporaryDirectory() as folder:
+            for mapfile in (None, os.path.join(folder, 'statevector.dat')):
+                circuit = QuantumCircuit('Memmap', q, mapfile)
+                circuit.addGate('h', [i for i in range(q)])
+                for i in range(q-1):
+                    circuit.cnot(i, i+1)
+                circuit.cp(0, q-1, np.pi/3)
+                circuit.addGate('h', [q-1, q-2])
+                applications = q + (q-1) + 1 + 2
+                t1 = time.time()
+                circuit.lazysim()
+                t2 = time.time()
+                states.append((t2 - t1, np.array(circuit.register.Statevec.Elements[::2**(q-10)])))
+                del circuit
+        rates = [applications*2**q/elapsed/1e6 for elapsed, state in states]
+        same = np.allclose(states[0][1], states[1][1])
+        print(f"{q} qubits: in memory {states[0][0]:.2f}s ({rates[0]:.1f}M amplitudes/s), memmap {states[1][0]:.2f}s ({rates[1]:.1f}M amplitudes/s), same state: {same}")
+    
+def parallelBenchmark(qubits=range(20, 27, 2), workers=None):
+    """
+    Runs the same circuit with lazysim while the gates share the blocks of the statevector between 
+    1 to N threads, and prints the runtime and speed up for each number of threads. 
+    Also checks that every number of threads gives the same statevector.
+
+    :param qubits: (list) The numbers of qubits of the circuits
+    :param workers: (list) The numbers of threads, defaults to 1 up to the number of cores
+    """
+    if workers is None: workers = range(1, os.cpu_count() + 1)
+    default = Sparse.LazyMatrix.Workers
+    for q in qubits:
+        circuit = QuantumCircuit('Parallel', q)
+        circuit.addGate('h', [i for i in range(q)])
+        for i in range(q-1):
+            circuit.cnot(i, i+1)
+        circuit.r([i for i in range(q)], np.pi/5)
+        circuit.swap(0, q-1)
+        times, states = [], []
+        for count in workers:
+            Sparse.LazyMatrix.Workers = count
+            circuit.register.reset()
+            t1 = time.time()
+            circuit.lazysim()
+            times.append(time.time() - t1)
+            states.append(np.array(circuit.register.Statevec.Elements[::2**(q-10)]))
+        Sparse.LazyMatrix.Workers = default
+        same = all(np.allclose(states[0], state) for state in states)
+        print(f"{q} qubits: " + ", ".join(f"{count} threads {t:.2f}s (x{times[0]/t:.2f})" for count, t in zip(workers, times)) + f", same state: {same}")
+    
+def shardBenchmark(qubits=22, processes=(1, 2, 4, 8)):
+    """
+    Runs the same circuit with run_circuit split into shards between a number of processes. 
+    For strong scaling the number of qubits is fixed, and for weak scaling one qubit is added 
+    each time the number of processes doubles, so each process keeps a shard of the same size.
+    Also checks that the statevectors match lazysim.
+
+    :param qubits: (int) The number of qubits for strong scaling, and with one process for weak scaling
+    :param processes: (list) The numbers of processes, powers of two
+    """
+    def circuitOf(q):
+        circuit = QuantumCircuit('Shards', q)
+        circuit.addGate('h', [i for i in range(q)])
+        for i in range(q-1):
+            circuit.cnot(i, i+1)
+        circuit.r([i for i in range(q)], np.pi/5)
+        circuit.swap(0, q-1)
+        return circuit
+
+    for scaling in ('strong', 'weak'):
+        print(f"{scaling} scaling:")
+        for count in processes:
+            q = qubits if scaling == 'strong' else qubits + int(np.log2(count))
+            circuit = circuitOf(q)
+            t1 = time.time()
+            circuit.lazysim()
+            t2 = time.time()
+            expected = np.array(circuit.register.Statevec.Elements)
+            circuit = circuitOf(q)
+            t3 = time.time()
+            circuit.run_circuit(processes=count)
+            t4 = time.time()
+            same = np.allclose(expected, circuit.register.Statevec.Elements)
+            print(f"{q} qubits, {count} processes: lazysim {t2-t1:.2f}s, shards {t4-t3:.2f}s, same state: {same}")
+    
+def precisionBenchmark():
+    """
+    Runs Grover and QFT circuits with lazysim in complex128 and complex64 precision, and prints the 
+    fidelity |<a|b>|^2 of the complex64 statevector against the complex128 one, the largest error of an 
+    amplitude, the change of the norm, and the runtime and memory of the statevector in each precision.
+    """
+    def grover(q, dtype):
+        circuit = QuantumCircuit('Grover', q, dtype=dtype)
+        circuit.addGate('h', [i for i in range(q)])
+        diagonal = np.ones(2**q)
+        diagonal[3] = -1
+        oracle = Sparse.SparseMatrix.from_diagonal(diagonal)
+        for i in range(int(np.pi/4*np.sqrt(2**q))):
+            circuit.addCustom(0, q-1, oracle, 'oracle')
+            Presentation.diffuser(circuit)
+        return circuit
+
+    def qft(q, dtype):
+        circuit = QuantumCircuit('QFT', q, dtype=dtype)
+        rng = np.random.default_rng(q)
+        circuit.setStateVector(rng.normal(size=2**q) + 1j*rng.normal(size=2**q))
+        Presentation.QFT(circuit)
+        return circuit
+
+    for name, build, sizes in (('Grover', grover, (6, 10, 14)), ('QFT', qft, (10, 16, 20))):
+        for q in sizes:
+            results = []
+            for dtype in (np.complex128, np.complex64):
+                circuit = build(q, dtype)
+                t1 = time.time()
+                circuit.lazysim()
+                results.append((time.time() - t1, circuit.register.Statevec.Elements))
+            (t128, a), (t64, b) = results
+            fidelity = abs(np.vdot(a, b.astype(complex)))**2
+            error = np.abs(a - b).max()
+            norm = abs(np.linalg.norm(b.astype(complex)) - 1)
+            print(f"{name} {q} qubits: fidelity {fidelity:.9f}, largest error {error:.2e}, norm change {norm:.2e}, "
+                  f"complex128 {t128:.3f}s {a.nbytes/2**20:.1f}MB, complex64 {t64:.3f}s {b.nbytes/2**20:.1f}MB")
+    
+def realBenchmark(qubits=range(16, 23, 2)):
+    """
+    Runs a few Grover iterations and a circuit of h, cnot, cz and swap gates with lazysim, keeping the 
+    real statevector as floats and as complex numbers, and compares the runtimes. 
+    Also checks that both give the same statevector and that the circuits are found to stay real.
+
+    :param qubits: (list) The numbers of qubits of the circuits
+    """
+    def grover(q):
+        circuit = QuantumCircuit('Grover', q)
+        circuit.addGate('h', [i for i in range(q)])
+        diagonal = np.ones(2**q)
+        diagonal[3] = -1
+        oracle = Sparse.SparseMatrix.from_diagonal(diagonal)
+        for i in range(3):
+            circuit.addCustom(0, q-1, oracle, 'oracle')
+            Presentation.diffuser(circuit)
+        return circuit
+
+    def layers(q):
+        circuit = QuantumCircuit('Layers', q)
+        for layer in range(5):
+            circuit.addGate('h', [i for i in range(q)])
+            for i in range(q-1):
+                circuit.cnot(i, i+1)
+            circuit.addBigGate(('cz', 0, q-1))
+            circuit.swap(1, q-2)
+        return circuit
+
+    default = QuantumRegister.QuantumRegister.RealStates
+    for name, build in (('Grover', grover), ('Layers', layers)):
+        for q in qubits:
+            results = []
+            for real in (False, True):
+                QuantumRegister.QuantumRegister.RealStates = real
+                circuit = build(q)
+                t1 = time.time()
+                circuit.lazysim()
+                results.append((time.time() - t1, circuit.register.Statevec.Elements))
+            QuantumRegister.QuantumRegister.RealStates = default
+            same = np.allclose(results[0][1], results[1][1])
+            print(f"{name} {q} qubits, stays real: {build(q).isReal()}: complex {results[0][0]:.3f}s, "
+                  f"real {results[1][0]:.3f}s (x{results[0][0]/results[1][0]:.2f}), same state: {same}")
+    
+def allocationBenchmark(qubits=range(16, 25, 4)):
+    """
+    Runs the same circuit with lazysim twice on one register, and prints how many arrays of elements 
+    the vectors allocated in each run, as counted by Vector.Allocations. The first run makes the spare 
+    buffer of the statevector and the second one reuses it, so it allocates nothing. This holds both for
+    a circuit with r gates, and for one of h, cnot and cz gates, where the statevector is kept as floats 
+    in the two halves of the complex spare buffer.
+
+    :param qubits: (list) The numbers of qubits of the circuits
+    """
+    for q in qubits:
+        for real in (False, True):
+            circuit = QuantumCircuit('Allocations', q)
+            for layer in range(5):
+                circuit.addGate('h', [i for i in range(q)])
+                for i in range(q-1):
+                    circuit.cnot(i, i+1)
+                if real: circuit.addBigGate(('cz', 0, q-1))
+                else: circuit.r([i for i in range(q)], np.pi/5)
+            gates = len(circuit.operations)
+            runs = []
+            for run in range(2):
+                circuit.register.reset()
+                before = Sparse.Vector.Allocations
+                t1 = time.time()
+                circuit.lazysim()
+                runs.append((Sparse.Vector.Allocations - before, time.time() - t1))
+            print(f"{q} qubits, {gates} operations, {'real' if real else 'complex'} circuit: first run {runs[0][0]} allocations "
+                  f"{runs[0][1]:.3f}s, second run {runs[1][0]} allocations {runs[1][1]:.3f}s")
+    
+def initBenchmark(qubits=range(10, 23, 4)):
+    """
+    Times making the statevector of a product state with a chain of Vector.outer calls, as the register
+    used to, against writing it in place with initialize, and setting a basis state with reset.
+    Also checks that initialize gives the same statevector as the outer products.
+
+    :param qubits: (list) The numbers of qubits of the registers
+    """
+    for q in qubits:
+        register = QuantumRegister.QuantumRegister(q)
+        register.setQbits(range(q), [[np.cos(i), np.sin(i)*1j] for i in range(q)])
+        t1 = time.time()
+        if q <= 18:
+            outer = Sparse.Vector(np.array([1], dtype=complex))
+            for qbit in register.Qbits[::-1]:
+                outer = outer.outer(qbit.vals)
+        t2 = time.time()
+        register.initialize()
+        t3 = time.time()
+        same = np.allclose(outer.Elements, register.Statevec.Elements) if q <= 18 else None
+        t4 = time.time()
+        register.reset()
+        t5 = time.time()
+        print(f"{q} qubits: outer products {f'{t2-t1:.4f}s' if q <= 18 else 'skipped'}, initialize {t3-t2:.4f}s, "
+              f"reset {t5-t4:.4f}s, same state: {same}")
+    
 def BorD_prompt():
     """
     A function to prompt for benchmark or demonstration.
@@ -274,6 +607,26 @@ if __name__ == '__main__':
         compareProbabilities()
         input("\nPress any key for the next test...")
         timeBenchmarks()
+        input("\nPress any key for the next test...")
+        multiplyBenchmark()
+        input("\nPress any key for the next test...")
+        compactionBenchmark()
+        input("\nPress any key for the next test...")
+        batchBenchmark()
+        input("\nPress any key for the next test...")
+        memmapBenchmark()
+        input("\nPress any key for the next test...")
+        parallelBenchmark()
+        input("\nPress any key for the next test...")
+        shardBenchmark()
+        input("\nPress any key for the next test...")
+        precisionBenchmark()
+        input("\nPress any key for the next test...")
+        realBenchmark()
+        input("\nPress any key for the next test...")
+        allocationBenchmark()
+        input("\nPress any key for the next test...")
+        initBenchmark()
     
     elif(BorD=='demo'):
         build = builder_prompt()